@@ -20,6 +20,7 @@ urlpatterns = patterns(
     url(r'^settings/$', 'hdd_indexer.views.settings', name='settings'),
     url(r'^crawler/$', 'hdd_indexer.views.crawler', name='crawler'),
     url(r'^loader/$', 'hdd_indexer.views.loader', name='loader'),
+    url(r'^watcher/$', 'hdd_indexer.views.watcher', name='watcher'),
     url(r'^export/$', 'hdd_indexer.views.export', name='export'),
     url(r'^organizer/$', 'hdd_indexer.views.organizer', name='organizer'),
     url(r'^comparator/$', 'hdd_indexer.views.comparator', name='comparator')
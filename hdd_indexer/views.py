@@ -3,6 +3,7 @@
     / - homepage
     /crawler [GET/POST] - crawler interactions
     /loader [GET/POST] - loader interactions
+    /watcher [GET/POST] - watcher interactions
     /settings [POST] - settings
     /setup [POST] - setup
 
@@ -26,6 +27,7 @@ log = logging.getLogger('server')
 log.info(72 * '-')
 log.info('server views loaded')
 
+from django.db.models import Q
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
@@ -46,6 +48,10 @@ from movie_metadata.load import loader_status
 from movie_metadata.load import start_loader
 from movie_metadata.load import stop_loader
 
+from movie_metadata.watch import watcher_status
+from movie_metadata.watch import start_watcher
+from movie_metadata.watch import stop_watcher
+
 from movie_metadata.models import Movie
 from movie_metadata.export import export as get_export_content
 
@@ -67,6 +73,13 @@ def crawler(request):
 
     POST:
         start(str): start the crawler
+        full(str): optional with start, crawl directories unchanged
+            since the last crawl as well
+        sniff(str): optional with start, reject new files which do
+            not have a video header
+        resume(str): optional with start, continue an unfinished crawl
+        purge(str): optional with start, delete movies whose files are
+            gone instead of marking them missing
         stop(str): stop the crawler
 
     Args:
@@ -97,6 +110,7 @@ def crawler(request):
             'files_evaluated': crawler_status('FILES_EVALUATED'),
             'movies_found': crawler_status('MOVIES_FOUND'),
             'movies_added': crawler_status('MOVIES_ADDED'),
+            'movies_swept': crawler_status('MOVIES_SWEPT'),
             'error': e,
             'error_message': e_m,
         }
@@ -116,7 +130,11 @@ def crawler(request):
         # print 'POST', request.POST
         if request.POST.get('start', None):
             log.info('POST: start crawler')
-            err_msg = start_crawler()
+            err_msg = start_crawler(
+                incremental=not request.POST.get('full', None),
+                sniff=bool(request.POST.get('sniff', None)),
+                resume=bool(request.POST.get('resume', None)),
+                purge=bool(request.POST.get('purge', None)))
             if err_msg:
                 log.error('start crawler: %s' % err_msg)
                 return response(err_msg)
@@ -134,6 +152,76 @@ def crawler(request):
     return HttpResponse(status=405)
 
 
+@csrf_exempt
+def watcher(request):
+    """watcher interactions on /watcher for hdd-indexer
+
+    Interactions with watcher using GET and POST
+
+    GET:
+        status(str): status of watcher ON/OFF
+
+    POST:
+        start(str): start watching the movie folders
+        stop(str): stop the watcher
+
+    Args:
+        request(RequestContext) - passed by Django
+
+    Returns:
+        response(HttpResponse) - resposne to GET/POST request
+
+    Raises:
+        None
+    """
+
+    def response(e_m=None):
+        """Response for GET/POST methods on watcher
+
+        returns a HTTPResponse with content type json
+
+        Args:
+            e_m(str): error message if any
+            e_m(None): if no error message
+        """
+        payload = {
+            'status': watcher_status(),
+            'mode': watcher_status('MODE'),
+            'events': watcher_status('EVENTS'),
+            'error': bool(e_m),
+            'error_message': e_m,
+        }
+        log.debug('watcher status: %s' % payload)
+        return HttpResponse(
+            json.dumps(payload),
+            content_type='application/json'
+        )
+
+    if request.method == 'GET':
+        if request.GET.get('status', None):
+            log.debug('GET: watcher status')
+            return response()
+    elif request.method == 'POST':
+        if request.POST.get('start', None):
+            log.info('POST: start watcher')
+            err_msg = start_watcher()
+            if err_msg:
+                log.error('start watcher: %s' % err_msg)
+                return response(err_msg)
+            return response()
+        elif request.POST.get('stop', None):
+            log.info('POST: stop watcher')
+            err_msg = stop_watcher()
+            if err_msg:
+                log.error('stop watcher: %s' % err_msg)
+                return response(err_msg)
+            return response()
+
+    # 405: Method not allowed
+    log.error('405: method not allowed')
+    return HttpResponse(status=405)
+
+
 @csrf_exempt
 def help(request):
     """Help for HDD-indexer
@@ -540,7 +628,8 @@ def export(request):
                  'filter=%s, ordering=%s' %
                  (file_format, fields, filter, order))
         content = get_export_content(
-            Movie, fields=fields, order=order, file_format=file_format)
+            Movie, fields=fields, filter=[Q(missing=False)], order=order,
+            file_format=file_format)
         if content is None:
             log.error('export error Http400')
             return HttpResponse(status=400)
@@ -1,3 +1,36 @@
+"""Admin for hdd_settings
+
+    CrawlerThrottleAdmin
+    ExtraMovieFolderAdmin
+    VideoExtensionAdmin
+
+"""
+
 from django.contrib import admin
+from solo.admin import SingletonModelAdmin
+
+from hdd_settings.models import CrawlerThrottle
+from hdd_settings.models import ExtraMovieFolder
+from hdd_settings.models import VideoExtension
+
+
+@admin.register(CrawlerThrottle)
+class CrawlerThrottleAdmin(SingletonModelAdmin):
+    """Admin for CrawlerThrottle class
+    """
+
+
+@admin.register(ExtraMovieFolder)
+class ExtraMovieFolderAdmin(admin.ModelAdmin):
+    """Admin for ExtraMovieFolder class
+    """
+    list_display = ('path', )
+    search_fields = ('path', )
+
 
-# Register your models here.
+@admin.register(VideoExtension)
+class VideoExtensionAdmin(admin.ModelAdmin):
+    """Admin for VideoExtension class
+    """
+    list_display = ('extension', )
+    search_fields = ('extension', )
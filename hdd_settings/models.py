@@ -5,8 +5,11 @@
 # TODO: test 'undefined' values are not accepted
 
 from __future__ import unicode_literals
+from collections import namedtuple
 from django.utils.encoding import python_2_unicode_compatible
 from django.db import models
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
 from solo.models import SingletonModel
 import os
 import re
@@ -158,7 +161,6 @@ class MovieFolder(SingletonModel):
     Attributes:
         relpath(str): relative path of the folder from hdd-root
     """
-    # TODO: Multiple Movie Folders on the hard disk
     relpath = models.CharField(
         max_length=500,
         verbose_name='Movie folder path',
@@ -205,6 +207,73 @@ class MovieFolder(SingletonModel):
         return super(MovieFolder, self).save(*args, **kwargs)
 
 
+@python_2_unicode_compatible
+class ExtraMovieFolder(models.Model):
+    """Extra Movie Folder
+
+    Another folder containing movies, crawled along with the movie
+    folder. It can be on the hdd or on any other disk attached to the
+    system. Movies found in it are tagged with its path. It cannot be
+    inside the movie folder or another extra folder, or contain one,
+    so that its movies are not found twice.
+
+    Attributes:
+        path(str): absolute path of the folder
+    """
+    path = models.CharField(
+        max_length=500,
+        unique=True,
+        verbose_name='Extra movie folder path',
+        help_text='''Absolute path of another folder containing movies''',)
+
+    def __str__(self):
+        """String representation of ExtraMovieFolder
+
+        Args:
+            self: current instance of ExtraMovieFolder
+
+        Returns:
+            path(str): absolute path of the folder
+
+        Raises:
+            None
+        """
+        return self.path
+
+    def save(self, *args, **kwargs):
+        """Save ExtraMovieFolder to database
+
+        checks if path is a valid directory, which does not overlap
+        the movie folder or another extra folder
+
+        Args:
+            self: current instance of ExtraMovieFolder
+            *args: arguments passed by system
+            **kwargs: keyword arguments passed by system
+
+        Returns:
+            calls super()
+
+        Raises:
+            ValueError: invalid path, or overlapping folders
+        """
+        if not os.path.isdir(self.path):
+            raise ValueError('The specified path is a not a valid folder.')
+        self.path = os.path.normpath(self.path)
+        others = [os.path.join(
+            HDDRoot.get_solo().path, MovieFolder.get_solo().relpath)]
+        others.extend(ExtraMovieFolder.objects.exclude(
+            pk=self.pk).values_list('path', flat=True))
+        for other in others:
+            other = os.path.normpath(other)
+            if self.path == other or \
+                    self.path.startswith(other.rstrip(os.sep) + os.sep) or \
+                    other.startswith(self.path.rstrip(os.sep) + os.sep):
+                raise ValueError(
+                    'The specified folder overlaps %s.' % other)
+        return super(ExtraMovieFolder, self).save(*args, **kwargs)
+
+
 @python_2_unicode_compatible
 class TMDbKey(SingletonModel):
     """
@@ -261,3 +330,272 @@ class OpenSubKey(SingletonModel):
             None
         """
         return ''.join((self.id, '--', self.key))
+
+
+@python_2_unicode_compatible
+class CrawlerThrottle(SingletonModel):
+    """Crawler Throttle
+
+    Limits on the disk operations of the crawler, applied separately to
+    each device, so that a crawl can run while movies are played from
+    the same disk.
+
+    Attributes:
+        stat_rate(int): stat operations per second, 0 for no limit
+        read_rate(int): megabytes read per second, 0 for no limit
+        workers(int): maximum number of threads listing directories
+        stat_latency(int): milliseconds a stat may take before the
+            number of threads is reduced, 0 to keep all threads
+    """
+    stat_rate = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Stat operations per second',
+        help_text='Files and folders looked up per second on each disk, '
+                  '0 for no limit',)
+    read_rate = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Megabytes read per second',
+        help_text='Data read from movie files per second on each disk, '
+                  '0 for no limit',)
+    workers = models.PositiveSmallIntegerField(
+        default=4,
+        verbose_name='Crawler threads per disk',
+        help_text='Maximum number of folders listed at the same time on '
+                  'each disk',)
+    stat_latency = models.PositiveIntegerField(
+        default=50,
+        verbose_name='Target stat latency (ms)',
+        help_text='The crawler uses fewer threads on a disk while looking '
+                  'up a file takes longer than this, 0 to disable',)
+
+    def __str__(self):
+        """String representation of CrawlerThrottle
+
+        Args:
+            self: current instance of CrawlerThrottle
+
+        Returns:
+            str: limits of the crawler
+
+        Raises:
+            None
+        """
+        return '%s stat/s, %s MB/s, %s threads' % (
+            self.stat_rate or 'unlimited',
+            self.read_rate or 'unlimited',
+            self.workers)
+
+
+@python_2_unicode_compatible
+class VideoExtension(models.Model):
+    """Video Extension
+
+    File extension used by the crawler to identify video files, in
+    addition to its built-in list of video file extensions.
+
+    Attributes:
+        extension(str): file extension including the leading dot,
+            stored in lowercase
+    """
+    extension = models.CharField(
+        max_length=20,
+        unique=True,
+        verbose_name='Video file extension',
+        help_text='''Extension of video files, such as .mkv''',)
+
+    class Meta(object):
+        """Meta attributes for VideoExtension
+
+        Attributes:
+            ordering: specifies ordering of VideoExtensions in admin
+        """
+        ordering = ['extension']
+
+    def __str__(self):
+        """String representation of VideoExtension
+
+        Args:
+            self: current instance of VideoExtension
+
+        Returns:
+            extension(str): file extension
+
+        Raises:
+            None
+        """
+        return self.extension
+
+    def save(self, *args, **kwargs):
+        """Save VideoExtension to database
+
+        normalizes the extension to lowercase with a leading dot
+        and checks it is a valid extension using regex pattern
+
+        Args:
+            self: current instance of VideoExtension
+            *args: arguments passed by system
+            **kwargs: keyword arguments passed by system
+
+        Returns:
+            calls super()
+
+        Raises:
+            ValueError: invalid extension
+        """
+        extension = self.extension.strip().lower()
+        if not extension.startswith('.'):
+            extension = '.' + extension
+        pattern = re.compile(r'^\.[0-9a-z_-]+$')
+        if not pattern.match(extension):
+            raise ValueError('Error! Video extension is invalid')
+        self.extension = extension
+        return super(VideoExtension, self).save(*args, **kwargs)
+
+
+class SettingsSnapshot(namedtuple(str('SettingsSnapshot'), (
+        'hdd_root',
+        'movie_folder',
+        'tmdb_key',
+        'opensub_uid',
+        'opensub_key',
+        'extra_folders',
+        'stat_rate',
+        'read_rate',
+        'crawl_workers',
+        'stat_latency',))):
+    """Settings Snapshot
+
+    Immutable copy of the singleton settings. A snapshot is taken once
+    at the start of a job (crawler, loader, organizer) and passed to
+    the functions it calls, so that the singletons are not read from
+    the database for every file.
+
+    Usage:
+        $ settings = settings_snapshot()
+        $ settings.movie_path(relpath)
+
+    Root:
+        Movies are tagged with the folder they were found in, called
+        their root. The movie folder is the empty root '', and each
+        extra movie folder is the root named by its absolute path.
+
+    Attributes:
+        hdd_root(str): absolute path of the hdd root
+        movie_folder(str): relative path of movie folder from hdd root
+        tmdb_key(str): TMDb API key
+        opensub_uid(str): OpenSubtitles API ID
+        opensub_key(str): OpenSubtitles API key
+        extra_folders(tuple): absolute paths of extra movie folders
+        stat_rate(int): crawler stat operations per second and device
+        read_rate(int): crawler bytes read per second and device
+        crawl_workers(int): crawler threads per device
+        stat_latency(float): crawler target stat latency in seconds
+    """
+    __slots__ = ()
+
+    @property
+    def movie_folder_path(self):
+        """Absolute path of the movie folder
+
+        Args:
+            self: current instance of SettingsSnapshot
+
+        Returns:
+            str: absolute path of movie folder
+
+        Raises:
+            None
+        """
+        return os.path.join(self.hdd_root, self.movie_folder)
+
+    @property
+    def movie_folders(self):
+        """Roots and absolute paths of all movie folders
+
+        Args:
+            self: current instance of SettingsSnapshot
+
+        Returns:
+            dict: root(str) -> absolute path of folder(str)
+
+        Raises:
+            None
+        """
+        folders = dict((folder, folder) for folder in self.extra_folders)
+        folders[''] = self.movie_folder_path
+        return folders
+
+    def movie_path(self, relpath, root=''):
+        """Absolute path of a movie file
+
+        Args:
+            self: current instance of SettingsSnapshot
+            relpath(str): relative path of movie file from its folder
+            root(str): root of the movie, '' for the movie folder
+
+        Returns:
+            str: absolute path of movie file
+
+        Raises:
+            None
+        """
+        if root:
+            return os.path.join(root, relpath)
+        return os.path.join(self.hdd_root, self.movie_folder, relpath)
+
+
+def settings_snapshot():
+    """Snapshot of the current settings
+
+    The snapshot is built from the singletons on first use and cached
+    until one of them is saved or deleted.
+
+    Args:
+        None
+
+    Returns:
+        SettingsSnapshot: current settings
+
+    Raises:
+        None
+    """
+    if settings_snapshot.__dict__.get('cached') is None:
+        opensub_key = OpenSubKey.get_solo()
+        throttle = CrawlerThrottle.get_solo()
+        settings_snapshot.cached = SettingsSnapshot(
+            hdd_root=HDDRoot.get_solo().path,
+            movie_folder=MovieFolder.get_solo().relpath,
+            tmdb_key=TMDbKey.get_solo().key,
+            opensub_uid=opensub_key.uid,
+            opensub_key=opensub_key.key,
+            extra_folders=tuple(ExtraMovieFolder.objects.order_by(
+                'path').values_list('path', flat=True)),
+            stat_rate=throttle.stat_rate,
+            read_rate=throttle.read_rate * 1024 * 1024,
+            crawl_workers=max(1, throttle.workers),
+            stat_latency=throttle.stat_latency / 1000.0,
+        )
+    return settings_snapshot.cached
+
+
+def _invalidate_settings_snapshot(sender, **kwargs):
+    """Discard the cached settings snapshot when a setting changes
+
+    Args:
+        sender(Model): singleton class that was saved or deleted
+        **kwargs: keyword arguments passed by signal
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    settings_snapshot.cached = None
+
+
+for _model in (
+        HDDRoot, MovieFolder, ExtraMovieFolder, TMDbKey, OpenSubKey,
+        CrawlerThrottle):
+    post_save.connect(_invalidate_settings_snapshot, sender=_model)
+    post_delete.connect(_invalidate_settings_snapshot, sender=_model)
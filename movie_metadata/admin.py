@@ -9,6 +9,7 @@ from django.contrib import admin
 from movie_metadata.models import Movie
 from movie_metadata.models import Actor
 from movie_metadata.models import Director
+from movie_metadata.models import LoadFailure
 from movie_metadata.models import Person
 
 
@@ -54,6 +55,8 @@ class MovieAdmin(admin.ModelAdmin):
     date_hierarchy = 'release'
     # filter results based on fields
     list_filter = (
+        'root',
+        'missing',
         'actors',
         'directors',
     )
@@ -258,3 +261,19 @@ class PersonAdmin(admin.ModelAdmin):
             )
         }),
     )
+
+
+@admin.register(LoadFailure)
+class LoadFailureAdmin(admin.ModelAdmin):
+    """Admin for movies the loader could not identify
+
+    Deleting a failure makes the next loader run try the movie again.
+    """
+    list_display = (
+        'title',
+        'failures',
+        'retry_after',
+        'updated',
+    )
+    ordering = ('retry_after',)
+    search_fields = ('title',)
@@ -0,0 +1,356 @@
+"""Cache responses of metadata providers on disk
+
+    The cache module keeps the JSON responses of OMDb, TMDb and IMDb in
+    a SQLite file of its own, separate from the movie database, so
+    that movies already looked up are not downloaded again when the
+    loader is run again, after a crash or after the database is reset.
+
+    Usage:
+        $ from movie_metadata.cache import cached
+        $ data = cached('omdb', 'i=tt0133093', lambda: get_json(url))
+
+    Keys:
+        Responses are keyed by provider and query. Queries are
+        normalized, so that titles differing only by case or spacing
+        share a response.
+
+    Expiry:
+        A response is used for the TTL of its provider, see _TTL, and
+        downloaded again once it is older. Errors and empty results are
+        not cached, so that a movie missing from a provider, or a
+        provider which answered with an error, is asked again.
+
+    Size:
+        The file holds at most _MAX_BYTES of responses. When it grows
+        larger, the least recently used responses are evicted until
+        it is back under _EVICT_RATIO of the cap. The time a response
+        was last used is written in batches of _USED_BATCH hits, so
+        that a hit does not wait for the disk.
+"""
+
+from os import makedirs
+from os import path
+from threading import Lock
+import json
+import sqlite3
+import time
+import logging
+log = logging.getLogger('load')
+log.info('cache module loaded')
+
+_CACHE_PATH = path.join('cache', 'responses.sqlite3')
+"""Cache file, relative to the working directory like the logs
+"""
+
+_DAY = 24 * 60 * 60  # seconds
+
+_TTL = {
+    'omdb': 30 * _DAY,
+    'tmdb': 30 * _DAY,
+    'imdb': 7 * _DAY,
+}
+"""Provider -> seconds a response is used for, ratings change faster
+than the rest of the metadata
+"""
+
+_DEFAULT_TTL = 7 * _DAY
+"""Seconds a response of any other provider is used for
+"""
+
+_MAX_BYTES = 64 * 1024 * 1024
+"""Largest total size of the responses in the cache
+"""
+
+_EVICT_RATIO = 0.9
+"""Fraction of _MAX_BYTES the cache is brought back to by an eviction
+"""
+
+_USED_BATCH = 100
+"""Number of hits whose time of use is written together
+"""
+
+_SHARED = {}
+"""Shared response cache, opened on first use
+"""
+
+_SHARED_LOCK = Lock()
+"""Lock for opening the shared response cache
+"""
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS response ('
+    ' provider TEXT NOT NULL,'
+    ' query TEXT NOT NULL,'
+    ' body TEXT NOT NULL,'
+    ' size INTEGER NOT NULL,'
+    ' stored REAL NOT NULL,'
+    ' used REAL NOT NULL,'
+    ' PRIMARY KEY (provider, query))',
+    'CREATE INDEX IF NOT EXISTS response_used ON response (used)',
+)
+"""Statements creating the cache table
+"""
+
+
+def normalize_query(query):
+    """Normalize a query for use as a cache key
+
+    Args:
+        query(str): title, IMDb ID or other query of a provider
+
+    Returns:
+        unicode: lowercase query with single spaces
+
+    Raises:
+        None
+    """
+    if not isinstance(query, unicode):
+        query = str(query).decode('utf-8', 'replace')
+    return ' '.join(query.lower().split())
+
+
+class ResponseCache(object):
+    """Response Cache
+
+    JSON responses stored in a SQLite file. A single connection is
+    shared by the loader threads, behind a lock.
+
+    Attributes:
+        filepath(str): path of the cache file
+        max_bytes(int): largest total size of the responses
+        ttl(dict): provider -> seconds a response is used for
+        hits(int): number of responses found in the cache
+        misses(int): number of responses not found, or expired
+        size(int): total size of the responses in bytes
+    """
+
+    def __init__(self, filepath=_CACHE_PATH, max_bytes=_MAX_BYTES,
+                 ttl=None):
+        """Open the cache file, creating it if needed
+
+        Args:
+            self: current instance of ResponseCache
+            filepath(str): path of the cache file
+            max_bytes(int): largest total size of the responses
+            ttl(dict): provider -> seconds a response is used for,
+                _TTL if None
+
+        Returns:
+            None
+
+        Raises:
+            sqlite3.Error: cache file could not be opened
+        """
+        self.filepath = filepath
+        self.max_bytes = max_bytes
+        self.ttl = _TTL if ttl is None else ttl
+        self.hits = 0
+        self.misses = 0
+        # (provider, query) -> time of use not written yet
+        self._used = {}
+        self._lock = Lock()
+        folder = path.dirname(filepath)
+        if folder and not path.isdir(folder):
+            makedirs(folder)
+        self._db = sqlite3.connect(filepath, check_same_thread=False)
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        self.size = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM response').fetchone()[0]
+        log.info('response cache %s opened with %s bytes' % (
+            filepath, self.size))
+
+    def get(self, provider, query):
+        """Response of a provider to a query
+
+        Args:
+            self: current instance of ResponseCache
+            provider(str): name of the provider, such as omdb
+            query(str): query sent to the provider
+
+        Returns:
+            JSON document of the response
+            None: if the response is not cached, or has expired
+
+        Raises:
+            None
+        """
+        key = (provider, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT body, size, stored FROM response '
+                'WHERE provider = ? AND query = ?', key).fetchone()
+            if row is not None and \
+                    now - row[2] > self.ttl.get(provider, _DEFAULT_TTL):
+                self._db.execute(
+                    'DELETE FROM response WHERE provider = ? AND query = ?',
+                    key)
+                self._db.commit()
+                self.size -= row[1]
+                self._used.pop(key, None)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._used[key] = now
+            self.hits += 1
+            if self.hits % _USED_BATCH == 0:
+                self._write_used()
+                self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, provider, query, data):
+        """Store the response of a provider to a query
+
+        Evicts the least recently used responses if the cache grows
+        larger than max_bytes.
+
+        Args:
+            self: current instance of ResponseCache
+            provider(str): name of the provider, such as omdb
+            query(str): query sent to the provider
+            data: JSON document of the response
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        key = (provider, normalize_query(query))
+        body = json.dumps(data)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT size FROM response '
+                'WHERE provider = ? AND query = ?', key).fetchone()
+            if row is not None:
+                self.size -= row[0]
+            self._db.execute(
+                'INSERT OR REPLACE INTO response '
+                '(provider, query, body, size, stored, used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                key + (body, len(body), now, now))
+            self.size += len(body)
+            self._write_used()
+            if self.size > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def flush(self):
+        """Write the times of use not written yet
+
+        Args:
+            self: current instance of ResponseCache
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        with self._lock:
+            if self._used:
+                self._write_used()
+                self._db.commit()
+
+    def _write_used(self):
+        """Write the times of use of the last hits, with the lock held
+
+        Args:
+            self: current instance of ResponseCache
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self._db.executemany(
+            'UPDATE response SET used = ? '
+            'WHERE provider = ? AND query = ?',
+            [(used, ) + key for key, used in self._used.iteritems()])
+        self._used.clear()
+
+    def _evict(self):
+        """Evict least recently used responses, with the lock held
+
+        Args:
+            self: current instance of ResponseCache
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        target = self.max_bytes * _EVICT_RATIO
+        evicted = 0
+        rows = self._db.execute(
+            'SELECT provider, query, size FROM response '
+            'ORDER BY used').fetchall()
+        for provider, query, size in rows:
+            if self.size <= target:
+                break
+            self._db.execute(
+                'DELETE FROM response WHERE provider = ? AND query = ?',
+                (provider, query))
+            self.size -= size
+            evicted += 1
+        log.info('%s responses evicted from cache, %s bytes left' % (
+            evicted, self.size))
+
+
+def response_cache():
+    """Shared response cache, opened on first use
+
+    Args:
+        None
+
+    Returns:
+        ResponseCache: shared cache
+        None: if the cache file could not be opened
+
+    Raises:
+        None
+    """
+    with _SHARED_LOCK:
+        if 'cache' not in _SHARED:
+            try:
+                _SHARED['cache'] = ResponseCache()
+            except (OSError, sqlite3.Error):
+                log.error('response cache could not be opened, '
+                          'responses are not cached')
+                _SHARED['cache'] = None
+        return _SHARED['cache']
+
+
+def cached(provider, query, fetch, keep=None, refresh=False):
+    """Response of a provider to a query, downloaded if not cached
+
+    Args:
+        provider(str): name of the provider, such as omdb
+        query(str): query sent to the provider
+        fetch(function): downloads the JSON document of the response
+        keep(function): called with a downloaded response, returns
+            False for errors and empty results, which are not cached
+        refresh(bool): download the response even if it is cached
+
+    Returns:
+        JSON document of the response
+
+    Raises:
+        exceptions raised by fetch
+    """
+    cache = response_cache()
+    if cache is None:
+        return fetch()
+    data = None if refresh else cache.get(provider, query)
+    if data is None:
+        data = fetch()
+        if data is not None and (keep is None or keep(data)):
+            cache.put(provider, query, data)
+    return data
@@ -0,0 +1,225 @@
+"""Pooled HTTP client for metadata providers
+
+    The client module keeps a single requests Session for the loader,
+    so that connections to OMDb, TMDb and IMDb are kept alive and
+    reused across movies instead of paying DNS, TCP and TLS setup on
+    every request. The session is shared by all loader threads.
+
+    Usage:
+        $ from movie_metadata.client import get_json
+        $ data = get_json('http://www.omdbapi.com/?i=tt0133093')
+
+    Connection pool:
+        Connections are pooled for up to _POOL_HOSTS hosts, with up to
+        _POOL_SIZE connections kept alive for each host. Requests beyond
+        the pool size open a connection which is dropped after use,
+        rather than waiting for a free one.
+
+    Timeouts:
+        Every request has a connect and a read timeout, _TIMEOUT by
+        default, so a provider which stops responding holds up a single
+        loader thread for a bounded time.
+
+    Circuit breakers:
+        The loader uses a circuit breaker for each metadata provider. A
+        breaker opens after a number of failures in a row, and requests
+        to its provider fail at once until it is reset: after a
+        timeout, a single request is let through, and closes the
+        breaker if it succeeds.
+"""
+
+from threading import Lock
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger('load')
+log.info('client module loaded')
+
+_POOL_HOSTS = 10
+"""Number of hosts for which connections are pooled
+"""
+
+_POOL_SIZE = 10
+"""Number of connections kept alive for each host, at least as many as
+loader workers
+"""
+
+_TIMEOUT = (5, 10)  # seconds
+"""Connect and read timeouts of a request
+"""
+
+_USER_AGENT = 'hdd-indexer'
+"""User agent sent to providers
+"""
+
+_SESSION = {}
+"""Shared session, created on first use
+"""
+
+_SESSION_LOCK = Lock()
+"""Lock for creating the shared session
+"""
+
+
+def session():
+    """Shared HTTP session
+
+    Creates the session on first use, with pooled adapters for http
+    and https.
+
+    Args:
+        None
+
+    Returns:
+        requests.Session: shared session
+
+    Raises:
+        None
+    """
+    with _SESSION_LOCK:
+        if 'session' not in _SESSION:
+            new_session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=_POOL_HOSTS,
+                pool_maxsize=_POOL_SIZE,
+                max_retries=0)
+            new_session.mount('http://', adapter)
+            new_session.mount('https://', adapter)
+            new_session.headers['User-Agent'] = _USER_AGENT
+            _SESSION['session'] = new_session
+            log.info('http session created, pool of %s connections '
+                     'for %s hosts' % (_POOL_SIZE, _POOL_HOSTS))
+        return _SESSION['session']
+
+
+def get_json(url, params=None, timeout=_TIMEOUT):
+    """Get a JSON document
+
+    Args:
+        url(str): url of the document
+        params(dict): query parameters added to the url
+        timeout(tuple): connect and read timeouts in seconds
+
+    Returns:
+        JSON document as dict or list
+
+    Raises:
+        requests.RequestException: network error, timeout or HTTP
+            error status
+        ValueError: response is not JSON
+    """
+    response = session().get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+class CircuitOpen(Exception):
+    """Request refused by an open circuit breaker
+    """
+
+
+class CircuitBreaker(object):
+    """Circuit Breaker
+
+    Stops requests to a service which keeps failing, see module
+    docstring.
+
+    Attributes:
+        name(str): name of the service, for the log
+        threshold(int): failures in a row which open the breaker
+        reset_timeout(float): seconds before a request is let through
+            an open breaker
+    """
+
+    def __init__(self, name, threshold, reset_timeout):
+        """Create a closed circuit breaker
+
+        Args:
+            self: current instance of CircuitBreaker
+            name(str): name of the service
+            threshold(int): failures in a row which open the breaker
+            reset_timeout(float): seconds before a request is let
+                through an open breaker
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = None
+        self._probing = False
+        self._lock = Lock()
+
+    def allow(self):
+        """Check that a request may be sent
+
+        Once the reset timeout has passed, a single request is let
+        through an open breaker until it succeeds or fails.
+
+        Args:
+            self: current instance of CircuitBreaker
+
+        Returns:
+            None
+
+        Raises:
+            CircuitOpen: the breaker is open
+        """
+        with self._lock:
+            if self._opened is None:
+                return
+            if not self._probing and \
+                    time.time() - self._opened >= self.reset_timeout:
+                self._probing = True
+                log.info('%s circuit half-open' % self.name)
+                return
+        raise CircuitOpen(self.name)
+
+    def success(self):
+        """Record a request which succeeded, closing the breaker
+
+        Args:
+            self: current instance of CircuitBreaker
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        with self._lock:
+            if self._opened is not None:
+                log.info('%s circuit closed' % self.name)
+            self._failures = 0
+            self._opened = None
+            self._probing = False
+
+    def failure(self):
+        """Record a request which failed, opening the breaker after
+        threshold failures in a row, or when a probe fails
+
+        Args:
+            self: current instance of CircuitBreaker
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                if not self._probing:
+                    log.warning('%s circuit opened after %s failures' % (
+                        self.name, self._failures))
+                self._opened = time.time()
+                self._probing = False
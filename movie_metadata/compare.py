@@ -73,7 +73,7 @@ def compare(datastream):
     # print that.keys()
 
     this = {}
-    movies = Movie.objects.all()[:3]
+    movies = Movie.objects.filter(missing=False)[:3]
     movies = movies
     for movie in movies:
         this[movie.imdb_id] = (movie.imdb_id, movie.title, movie.release)
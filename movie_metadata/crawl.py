@@ -1,30 +1,49 @@
 """Crawl hdd looking for movie files
 
-    The crawl module browses the movie_folder specified in the
-    database looking for movie files. It uses a tuple containing
-    the movie extensions and checks for movies based on a threshold
-    file size.
+    The crawl module browses the movie_folder and the extra movie
+    folders specified in the database looking for movie files. It uses
+    a set of lowercase video extensions, compiled from the database
+    when the crawl starts, and checks for movies based on a threshold
+    file size. Directories are listed concurrently by pools of scandir
+    workers, one pool for each device, while movies are saved on the
+    crawler thread.
 
     Usage:
         $ from movie_metadata import crawl
         $ crawl.function_name()
 """
 
+import errno
+import hashlib
+import json
+from os import lstat
 from os import path
 from os import stat
-from os import walk
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+import Queue
 import re
 import threading
+import time
 import logging
+import traceback
 log = logging.getLogger('crawl')
 log.info(72 * '-')
 log.info('crawl module loaded')
 
-from hdd_settings.models import HDDRoot
-from hdd_settings.models import MovieFolder
+from hdd_settings.models import settings_snapshot
+from hdd_settings.models import VideoExtension
+from django.db import transaction
+
+from movie_metadata.models import CrawlCheckpoint
+from movie_metadata.models import DirectorySnapshot
 from movie_metadata.models import Movie
+from movie_metadata.probe import Prober
+from movie_metadata.release import parse_release
+from movie_metadata.throttle import Throttles
 
-# TODO: video filetypes as model
 # TODO: movie size threshold as solo object
 _VIDEO_FILETYPES = (
     '.264', '.3g2', '.3gp', '.3gp2', '.3gpp', '.3gpp2', '.3mm', '.3p2', '.60d',
@@ -80,15 +99,68 @@ _VIDEO_FILETYPES = (
     '.xel', '.xesc', '.xfl', '.xlmv', '.xmv', '.xvid', '.y4m', '.yog', '.yuv',
     '.zeg', '.zm1', '.zm2', '.zm3', '.zmv', )
 """Video File Extensions
-    File extensions for identifying movie files
+    Default file extensions for identifying movie files, extended by
+    the VideoExtension configured in database
 """
 log.info('videos extensions')
 log.info(_VIDEO_FILETYPES)
 
-_MOVIE_SIZE_THRESHOLD = 300000000  # 300MB
+MOVIE_SIZE_THRESHOLD = 300000000  # 300MB
 """File size threshold to differentiate videos and movies
 """
-log.info('movie size threshold: %s' % _MOVIE_SIZE_THRESHOLD)
+log.info('movie size threshold: %s' % MOVIE_SIZE_THRESHOLD)
+
+_CRAWL_WORKERS = 4
+"""Number of threads listing directories concurrently on each device
+"""
+log.info('crawl workers: %s' % _CRAWL_WORKERS)
+
+_BATCH_SIZE = 500
+"""Number of new movies saved to database in one transaction
+"""
+
+_FLUSH_INTERVAL = 5  # seconds
+"""Time after which new movies are saved even if the batch is not full
+"""
+
+_CHECKPOINT_INTERVAL = 1000
+"""Number of directories crawled between two checkpoints
+"""
+
+RACY_MTIME = 2  # seconds
+"""Directories modified this close to the start of a crawl are listed
+again by the next crawl, since a change within the same timestamp
+granularity (2 seconds on FAT) would not be visible in their mtime
+"""
+
+_SETTLE_TIME = 60  # seconds
+"""Video files modified this close to a listing, or smaller than
+MOVIE_SIZE_THRESHOLD, may still be copied, and their directory is
+listed again by the next crawl
+"""
+
+_LOG_INTERVAL = 10  # seconds
+"""Minimum time between two progress lines in the crawl log
+"""
+
+_CLEAN_CACHE_SIZE = 4096
+"""Number of parsed filenames remembered by parse_filename
+"""
+
+_CLEAN_CACHE = [{}, {}]
+"""Current and previous generation of filename -> ReleaseInfo
+"""
+
+_DISC_FOLDERS = frozenset(('video_ts', 'bdmv'))
+"""Lowercase names of the folders of DVD and Blu-ray structures
+"""
+
+_PART = re.compile(
+    r"[\s._\-\(\[]+(cd|disc|disk|part|pt)[\s._\-]*0?([1-9])"
+    r"(?=$|[\s._\-\)\]])",
+    re.IGNORECASE)
+"""Part tag of a movie split into parts, such as .CD1 or - Part 2
+"""
 
 _ERROR = {
     1: 'HDD Root not configured properly.',
@@ -98,38 +170,124 @@ _ERROR = {
 """
 
 
+class CrawlerCounters(object):
+    """Crawler Counters
+
+    Progress of the crawler as plain attributes. The counters are only
+    written by the crawler thread and read by the /crawler status view,
+    so they need no lock, and updating them does not write to the log.
+    Progress is logged at most once every _LOG_INTERVAL seconds.
+
+    Attributes:
+        STATUS(bool): True for ON, False for OFF
+        FILES_EVALUATED(int): number of files listed
+        MOVIES_FOUND(int): number of movie files found
+        MOVIES_ADDED(int): number of new movies, counted when they are
+            queued to be saved to database
+        MOVIES_SWEPT(int): number of movies marked missing or deleted
+            after the crawl, see _sweep_movies
+    """
+    __slots__ = (
+        'STATUS',
+        'FILES_EVALUATED',
+        'MOVIES_FOUND',
+        'MOVIES_ADDED',
+        'MOVIES_SWEPT',
+        '_logged',
+    )
+
+    def __init__(self):
+        """Create counters for a stopped crawler
+
+        Args:
+            self: current instance of CrawlerCounters
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.STATUS = False
+        self.reset()
+
+    def reset(self):
+        """Set all counters to zero
+
+        Args:
+            self: current instance of CrawlerCounters
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.FILES_EVALUATED = 0
+        self.MOVIES_FOUND = 0
+        self.MOVIES_ADDED = 0
+        self.MOVIES_SWEPT = 0
+        self._logged = 0
+
+    def log(self, force=False):
+        """Log crawler progress, if not logged recently
+
+        Args:
+            self: current instance of CrawlerCounters
+            force(bool): log even if logged recently
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        now = time.time()
+        if force or now - self._logged >= _LOG_INTERVAL:
+            self._logged = now
+            log.info('crawler progress: %s files evaluated, '
+                     '%s movies found, %s movies added' % (
+                         self.FILES_EVALUATED,
+                         self.MOVIES_FOUND,
+                         self.MOVIES_ADDED))
+
+
+_COUNTERS = CrawlerCounters()
+"""Progress of the current or last crawl
+"""
+
+
 def crawler_status(key=None, value=None):
     """Crawler status
 
     Args:
-        key(dict key): key to search in dict
-        value(dict value): value to assign to key
+        key(str): name of counter, see CrawlerCounters
+        value: value to assign to counter
 
     Returns:
         bool: True for ON, False for OFF
+        value of counter if key is given without a value
     """
-    if 'status' not in crawler_status.__dict__:
-        crawler_status.status = {
-            'STATUS': False,
-            'FILES_EVALUATED': 0,
-            'MOVIES_FOUND': 0,
-            'MOVIES_ADDED': 0,
-        }
-    _CRAWLER = crawler_status.status
-    if _CRAWLER.get(key) is not None:
+    if key in CrawlerCounters.__slots__ and not key.startswith('_'):
         if value is not None:
-            log.info('crawler status: %s -> %s' % (key, value))
-            _CRAWLER[key] = value
+            if key == 'STATUS':
+                log.info('crawler status: %s -> %s' % (key, value))
+            setattr(_COUNTERS, key, value)
         else:
-            return _CRAWLER[key]
-    return _CRAWLER['STATUS']
+            return getattr(_COUNTERS, key)
+    return _COUNTERS.STATUS
 
 
-def start_crawler():
+def start_crawler(incremental=True, sniff=False, resume=False, purge=False):
     """Start the crawler
 
     Args:
-        None
+        incremental(bool): skip directories unchanged since last crawl
+        sniff(bool): reject new files without a video header
+        resume(bool): continue from the checkpoint of an unfinished
+            crawl, if there is one
+        purge(bool): delete movies whose files are gone instead of
+            marking them missing
 
     Returns:
         None
@@ -138,21 +296,34 @@ def start_crawler():
         None
     """
     log.info('start crawler')
-    hdd_root = HDDRoot.get_solo().path
-    if not path.exists(hdd_root):
+    settings = settings_snapshot()
+    if not path.exists(settings.hdd_root):
         print _ERROR[1]
-        log.error('%s is not a valid hdd root path' % hdd_root)
+        log.error('%s is not a valid hdd root path' % settings.hdd_root)
         return _ERROR[1]
-    movie_folder = MovieFolder.get_solo().relpath
-    if not path.exists(path.join(hdd_root, movie_folder)):
+    if not path.exists(settings.movie_folder_path):
         print _ERROR[2]
-        log.error('%s is not a valid movie folder path' % movie_folder)
+        log.error('%s is not a valid movie folder path' % (
+            settings.movie_folder))
         return _ERROR[2]
+    extra_folders = tuple(
+        folder for folder in settings.extra_folders if path.isdir(folder))
+    for folder in set(settings.extra_folders) - set(extra_folders):
+        log.warning('%s is not a valid folder, not crawled' % folder)
+    settings = settings._replace(extra_folders=extra_folders)
+    _COUNTERS.reset()
     crawler_status('STATUS', True)
-    crawler_status('FILES_EVALUATED', 0)
-    crawler_status('MOVIES_FOUND', 0)
-    crawler_status('MOVIES_ADDED', 0)
-    thread = threading.Thread(target=crawl_movies)
+    thread = threading.Thread(
+        target=crawl_movies,
+        kwargs={
+            'settings': settings,
+            'workers': settings.crawl_workers,
+            'incremental': incremental,
+            'sniff': sniff,
+            'resume': resume,
+            'purge': purge,
+        },
+    )
     thread.daemon = True
     thread.start()
     log.info('crawl started on daemon thread')
@@ -174,14 +345,72 @@ def stop_crawler():
     crawler_status('STATUS', False)
 
 
-def crawl_movies():
+def crawl_movies(
+        settings=None,
+        workers=_CRAWL_WORKERS,
+        incremental=True,
+        batch_size=_BATCH_SIZE,
+        flush_interval=_FLUSH_INTERVAL,
+        sniff=False,
+        resume=False,
+        checkpoint_interval=_CHECKPOINT_INTERVAL,
+        purge=False):
     """Crawl for Movies on HDD
 
     Looks for movies on the HDD based on file extensions and
-    threshold size. Saves them to database.
+    threshold size. Saves them to database in batches.
+
+    The streams of a DVD (VIDEO_TS) or Blu-ray (BDMV) structure are
+    saved as a single movie for the folder containing the structure,
+    and the parts of a multi-part movie (CD1, CD2) as a single movie
+    for the first part, see disc_relpath and _group_parts.
+
+    A movie file which was renamed or moved since the last crawl is
+    matched to its movie in database by size and inode, or by size and
+    OpenSubtitles hash, and only its path is updated. The loader does
+    not download its metadata again.
+
+    The movie folder and all extra movie folders are crawled together.
+    Folders on different devices are listed by separate groups of
+    workers, so that a slow disk does not hold up the others. Movies
+    are tagged with the root of the folder they are found in.
+
+    Stat operations and file reads are throttled for each device, as
+    configured by CrawlerThrottle, see movie_metadata.throttle.
+
+    A snapshot of every directory is saved after a complete crawl.
+    Incremental crawls do not list directories whose modification
+    time and inode match the snapshot, and only descend into their
+    known subdirectories. The snapshot is dropped when the video
+    extensions change.
+
+    The directories not yet crawled are saved to a checkpoint every
+    few directories, and when the crawler is stopped. A resumed crawl
+    starts from these directories, and merges its directories into
+    the saved snapshot.
+
+    After a complete crawl, movies in database whose files were not
+    found are marked missing, or deleted with purge, see _sweep_movies.
+    A resumed crawl does not sweep, since it has not seen the
+    directories crawled before it was stopped.
 
     Args:
-        None
+        settings(SettingsSnapshot): settings for this crawl,
+            current settings if None
+        workers(int): number of threads listing directories on each
+            device
+        incremental(bool): skip directories unchanged since last crawl
+        batch_size(int): movies saved to database together
+        flush_interval(int): seconds after which movies are saved
+            even if the batch is not full
+        sniff(bool): check the header of new files and reject those
+            which are not videos, see movie_metadata.probe
+        resume(bool): continue from the checkpoint of an unfinished
+            crawl, if there is one
+        checkpoint_interval(int): directories crawled between two
+            checkpoints
+        purge(bool): delete movies whose files are gone instead of
+            marking them missing
 
     Returns:
         None
@@ -189,84 +418,975 @@ def crawl_movies():
     Raises:
         AssertionError
     """
-    movie_folder_path = path.join(
-        HDDRoot.get_solo().path,
-        MovieFolder.get_solo().relpath,
+    if settings is None:
+        settings = settings_snapshot()
+    folders = settings.movie_folders
+    for folder in sorted(folders.values()):
+        log.info('crawl movie folder path : %s' % folder)
+    # (root, directory) not yet crawled
+    frontier = None
+    if resume:
+        frontier = _load_checkpoint(settings)
+    resumed = bool(frontier)
+    if not resumed:
+        frontier = set(
+            (root, path.normpath(folder))
+            for root, folder in folders.iteritems()
+        )
+    started = time.time()
+    extensions = video_extensions()
+    if incremental:
+        snapshot = _load_snapshot(settings, extensions)
+    else:
+        snapshot = {}
+    directories = {}
+    known_relpaths, sizes = _known_movies()
+    # movies waiting to be saved in a single transaction
+    buffered = []
+    prober = Prober(sniff=sniff)
+    throttles = Throttles(settings)
+    # time of the last save, in a list so that flush can update it
+    flushed = [time.time()]
+    counters = _COUNTERS
+    crawled = 0
+    # (root, relpath of disc) -> (filepath, size, inode) of the largest
+    # stream of DVD and Blu-ray structures found so far
+    discs = {}
+    # (root, relpath) of movies found, and (root, relpath) of the
+    # directories walked and of those listed, for the sweep
+    seen = set()
+    visited = set()
+    listed = set()
+
+    def found_movie(root, relpath, filepath, name, size, inode, parts=1):
+        """New Movie for a movie found on disk
+
+        Returns None for a movie in database, and updates the path of a
+        movie renamed or moved on the same device, which keeps its inode.
+        """
+        counters.MOVIES_FOUND += 1
+        seen.add((root, relpath))
+        if _movie_exists_with_relpath(relpath, known_relpaths, root):
+            return None
+        moved = match_moved(settings, sizes.get(size), inode=inode)
+        if moved is not None:
+            move_movie(moved, root, relpath, inode)
+            sizes[size].remove(moved)
+            known_relpaths.discard(moved[1:3])
+            known_relpaths.add((root, relpath))
+            return None
+        release = parse_filename(name)
+        movie = Movie()
+        movie.title = release.title
+        movie.year = release.year
+        movie.relpath = relpath
+        movie.root = root
+        movie.filesize = size
+        movie.inode = inode
+        movie.parts = parts
+        return movie, filepath
+
+    def queue_movies(root, new_movies):
+        """Hash new movies, queue videos to be saved to database
+
+        Movies which are not videos are rejected, and movies moved
+        across devices, or copied and deleted, are matched by hash.
+        """
+        new_movies = [new_movie for new_movie in new_movies if new_movie]
+        probed = prober.probe([
+            (filepath, movie.filesize) for movie, filepath in new_movies
+        ], throttles.for_root(root))
+        for (movie, filepath), (video, filehash) in zip(
+                new_movies, probed):
+            if not video:
+                counters.MOVIES_FOUND -= 1
+                continue
+            movie.filehash = filehash or ''
+            known_relpaths.add((movie.root, movie.relpath))
+            moved = match_moved(
+                settings, sizes.get(movie.filesize), filehash=filehash)
+            if moved is not None:
+                move_movie(moved, movie.root, movie.relpath, movie.inode)
+                sizes[movie.filesize].remove(moved)
+                known_relpaths.discard(moved[1:3])
+                continue
+            buffered.append(movie)
+            counters.MOVIES_ADDED += 1
+            log.debug('%s queued for database' % movie.title)
+
+    def flush(force=False):
+        """Save the queued movies when the batch is full, when they have
+        waited for flush_interval, or when forced
+
+        Also called while no directory is listed, see walk_folders.
+        """
+        if force or len(buffered) >= batch_size or \
+                time.time() - flushed[0] >= flush_interval:
+            save_movies(buffered)
+            del buffered[:]
+            flushed[0] = time.time()
+
+    def queue_discs():
+        """Queue the discs found so far as single movies
+        """
+        for (root, disc), (filepath, size, inode) in discs.iteritems():
+            queue_movies(root, [found_movie(
+                root, disc, filepath, disc_name(disc, folders[root]),
+                size, inode)])
+        discs.clear()
+
+    # a folder nested in another one belongs to the deepest folder only,
+    # as for the watcher
+    nested = frozenset(path.normpath(folder) for folder in folders.values())
+    for root, dirpath, files, state, subdirs in walk_folders(
+            list(frontier), extensions, workers, snapshot,
+            throttles=throttles, idle=(flush_interval, flush),
+            exclude=nested):
+        if not counters.STATUS:
+            break
+        if crawled and crawled % checkpoint_interval == 0:
+            # all directories crawled so far are in database
+            queue_discs()
+            flush(force=True)
+            _save_checkpoint(settings, frontier)
+        crawled += 1
+        frontier.discard((root, dirpath))
+        frontier.update((root, subdir) for subdir in subdirs)
+        if state is not None:
+            if state[0] >= started - RACY_MTIME:
+                state = (0.0, ) + state[1:]
+            directories[(root, dirpath)] = state
+        reldir = _relative_dir(dirpath, folders[root])
+        visited.add((root, reldir))
+        disc = disc_relpath(reldir)
+        if disc is not None:
+            # the disc is still there, even if its streams are unchanged
+            seen.add((root, disc))
+        if files is None:
+            # directory unchanged since last crawl
+            continue
+        if state is not None:
+            listed.add((root, reldir))
+        counters.FILES_EVALUATED += len(files)
+        # size is only looked up for files with video extensions
+        found = [
+            (filename, size, inode) for filename, size, inode in files
+            if size is not None and size >= MOVIE_SIZE_THRESHOLD
+        ]
+        if found and disc is not None:
+            # streams of a DVD or Blu-ray, the largest is the main title
+            for filename, size, inode in found:
+                largest = discs.get((root, disc))
+                if largest is None or size > largest[1]:
+                    discs[(root, disc)] = (
+                        path.join(dirpath, filename), size, inode)
+            found = []
+        new_movies = []
+        for filename, size, inode, parts in _group_parts(found):
+            name = path.splitext(filename)[0]
+            if parts > 1:
+                # the title is parsed without the part tag
+                name = part_number(name)[0]
+            new_movies.append(found_movie(
+                root,
+                path.relpath(path.join(dirpath, filename), folders[root]),
+                path.join(dirpath, filename),
+                name,
+                size,
+                inode,
+                parts))
+        queue_movies(root, new_movies)
+        flush()
+        counters.log()
+
+    queue_discs()
+    flush(force=True)
+    counters.log(force=True)
+    prober.close()
+    if not crawler_status():
+        # crawler was stopped before the walk completed
+        _save_checkpoint(settings, frontier)
+        return
+    _save_snapshot(settings, directories, extensions, replace=not resumed)
+    _save_checkpoint(settings, ())
+    if not resumed:
+        counters.MOVIES_SWEPT = _sweep_movies(
+            settings, seen, visited, listed, purge, batch_size)
+    crawler_status('STATUS', False)
+
+
+def _relative_dir(dirpath, folder):
+    """Relative path of a directory from its movie folder
+
+    Args:
+        dirpath(str): absolute path of the directory
+        folder(str): absolute path of the movie folder
+
+    Returns:
+        str: relative path, '' for the movie folder itself
+
+    Raises:
+        None
+    """
+    relpath = path.relpath(dirpath, folder)
+    return '' if relpath == path.curdir else relpath
+
+
+def _sweep_movies(
+        settings,
+        seen,
+        visited,
+        listed,
+        purge=False,
+        batch_size=_BATCH_SIZE):
+    """Mark or delete movies whose files are gone
+
+    A movie is stale when it was not seen by the crawl, and the closest
+    directory of its path which was walked was also listed: either its
+    directory was listed without the file, or its directory is gone
+    from a listed parent. Movies in directories skipped as unchanged,
+    or which could not be listed, are kept. Movies of folders which are
+    not crawled anymore are kept as well. A stale movie is only swept
+    once its path is confirmed gone with lstat, so files which are no
+    longer movies, such as a video below the size threshold or with
+    an extension removed from the settings, and files which could not
+    be read, are kept.
+
+    Stale movies are marked missing, so that their metadata is kept if
+    the file comes back, or deleted with purge. Missing movies which
+    were seen again are marked present. Rows are updated in chunks of
+    batch_size primary keys.
+
+    Args:
+        settings(SettingsSnapshot): settings for this crawl
+        seen(set): (root, relpath) of movies found by the crawl
+        visited(set): (root, relpath) of directories walked, '' for
+            the movie folder
+        listed(set): (root, relpath) of directories listed
+        purge(bool): delete stale movies instead of marking them
+        batch_size(int): primary keys updated in one query
+
+    Returns:
+        int: number of movies marked missing or deleted
+
+    Raises:
+        None
+    """
+    folders = settings.movie_folders
+    stale = []
+    found = []
+    for pk, root, relpath, missing in Movie.objects.values_list(
+            'pk', 'root', 'relpath', 'missing').iterator():
+        if (root, relpath) in seen:
+            if missing:
+                found.append(pk)
+            continue
+        if (missing and not purge) or root not in folders:
+            continue
+        directory = path.dirname(relpath)
+        while directory and (root, directory) not in visited:
+            directory = path.dirname(directory)
+        if (root, directory) in listed and \
+                _is_gone(path.join(folders[root], relpath)):
+            stale.append(pk)
+    for i in range(0, len(found), batch_size):
+        Movie.objects.filter(pk__in=found[i:i + batch_size]).update(
+            missing=False)
+    for i in range(0, len(stale), batch_size):
+        with transaction.atomic():
+            movies = Movie.objects.filter(pk__in=stale[i:i + batch_size])
+            if purge:
+                movies.delete()
+            else:
+                movies.update(missing=True)
+    if found:
+        log.info('%s missing movies found again' % len(found))
+    log.info('%s movies %s' % (
+        len(stale), 'deleted' if purge else 'marked missing'))
+    return len(stale)
+
+
+def _is_gone(filepath):
+    """Check that a file or directory does not exist anymore
+
+    Args:
+        filepath(str): absolute path of the file or directory
+
+    Returns:
+        bool: True if the path does not exist, False if it exists or
+            could not be checked
+
+    Raises:
+        None
+    """
+    try:
+        lstat(filepath)
+    except OSError as e:
+        return e.errno in (errno.ENOENT, errno.ENOTDIR)
+    return False
+
+
+def disc_relpath(relpath):
+    """Relative path of the disc structure containing a path
+
+    Args:
+        relpath(str): relative path of a file or directory from its
+            root
+
+    Returns:
+        str: relative path of the folder containing the VIDEO_TS or
+            BDMV folder of the path, or of the VIDEO_TS or BDMV folder
+            itself when it is directly in the movie folder
+        None: if the path is not within a disc structure
+
+    Raises:
+        None
+    """
+    parts = path.normpath(relpath).split(path.sep)
+    for i, part in enumerate(parts):
+        if part.lower() in _DISC_FOLDERS:
+            return path.join(*parts[:max(i, 1)])
+    return None
+
+
+def disc_name(disc, folder):
+    """Name of a DVD or Blu-ray movie, its title is parsed from
+
+    Args:
+        disc(str): relative path of the disc, see disc_relpath
+        folder(str): absolute path of the movie folder of the disc
+
+    Returns:
+        str: name of the folder containing the disc structure, the
+            movie folder for a structure directly in it
+
+    Raises:
+        None
+    """
+    name = path.basename(disc)
+    if name.lower() in _DISC_FOLDERS:
+        name = path.basename(path.normpath(folder))
+    return name
+
+
+def part_number(name):
+    """Part number of a movie file split into parts
+
+    Args:
+        name(str): filename without extension
+
+    Returns:
+        tuple(stem, number):
+            stem(str): filename without the part tag
+            number(int): part number
+        None: if the name has no part tag
+
+    Raises:
+        None
+    """
+    match = _PART.search(name)
+    if match is None:
+        return None
+    return name[:match.start()] + name[match.end():], int(match.group(2))
+
+
+def _group_parts(files):
+    """Group the parts of multi-part movies in a directory
+
+    Parts are grouped when their names only differ by the part tag,
+    and the first part stands for the movie.
+
+    Args:
+        files(list): (filename, size, inode) of movie files
+
+    Returns:
+        list: (filename, size, inode, parts) of movies, parts is the
+            number of files of the movie
+
+    Raises:
+        None
+    """
+    movies = []
+    groups = {}
+    for filename, size, inode in files:
+        name, extension = path.splitext(filename)
+        part = part_number(name)
+        if part is None:
+            movies.append((filename, size, inode, 1))
+            continue
+        stem = (part[0] + extension).lower()
+        groups.setdefault(stem, []).append((part[1], filename, size, inode))
+    for parts in groups.itervalues():
+        number, filename, size, inode = min(parts)
+        movies.append((filename, size, inode, len(parts)))
+    return movies
+
+
+def save_movies(movies):
+    """Save movies to database in a single transaction
+
+    Movie.save is not called by bulk_create, so the slug of every
+    movie is created before inserting them.
+
+    Args:
+        movies(list): unsaved Movie objects
+
+    Returns:
+        int: number of movies saved
+
+    Raises:
+        None
+    """
+    if not movies:
+        return 0
+    for movie in movies:
+        movie.make_slug()
+    with transaction.atomic():
+        Movie.objects.bulk_create(movies)
+    log.info('%s movies added to database' % len(movies))
+    return len(movies)
+
+
+def _load_snapshot(settings, extensions):
+    """Load the directory snapshot saved by the last complete crawl
+
+    Directories of folders which are no longer configured are ignored,
+    and so are directories listed with other video extensions.
+
+    Args:
+        settings(SettingsSnapshot): settings for this crawl
+        extensions(frozenset): lowercase video file extensions
+
+    Returns:
+        dict: absolute directory path -> (mtime, inode)
+
+    Raises:
+        None
+    """
+    folders = settings.movie_folders
+    snapshot = {}
+    for root, relpath, mtime, inode in \
+            DirectorySnapshot.objects.filter(
+                extensions=_extensions_key(extensions),
+            ).values_list('root', 'relpath', 'mtime', 'inode').iterator():
+        if root not in folders:
+            continue
+        dirpath = path.normpath(path.join(folders[root], relpath))
+        snapshot[dirpath] = (mtime, inode)
+    log.info('loaded snapshot of %s directories' % len(snapshot))
+    return snapshot
+
+
+def _save_snapshot(settings, directories, extensions, replace=True):
+    """Save the directory snapshot
+
+    Args:
+        settings(SettingsSnapshot): settings for this crawl
+        directories(dict): (root, absolute directory path) ->
+            (mtime, inode)
+        extensions(frozenset): lowercase video file extensions the
+            directories were listed with
+        replace(bool): replace the saved snapshot, otherwise only
+            the given directories are replaced
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    folders = settings.movie_folders
+    key = _extensions_key(extensions)
+    snapshots = [
+        DirectorySnapshot(
+            root=root,
+            relpath=path.relpath(dirpath, folders[root]),
+            mtime=mtime,
+            inode=inode,
+            extensions=key,
+        )
+        for (root, dirpath), (mtime, inode) in directories.iteritems()
+    ]
+    with transaction.atomic():
+        if replace:
+            DirectorySnapshot.objects.all().delete()
+        else:
+            relpaths = {}
+            for snapshot in snapshots:
+                relpaths.setdefault(snapshot.root, []).append(
+                    snapshot.relpath)
+            for root, root_relpaths in relpaths.iteritems():
+                for i in range(0, len(root_relpaths), _BATCH_SIZE):
+                    DirectorySnapshot.objects.filter(
+                        root=root,
+                        relpath__in=root_relpaths[i:i + _BATCH_SIZE],
+                    ).delete()
+        DirectorySnapshot.objects.bulk_create(snapshots)
+    log.info('saved snapshot of %s directories' % len(directories))
+
+
+def _extensions_key(extensions):
+    """Key of a set of video extensions, saved with the snapshot
+
+    Args:
+        extensions(frozenset): lowercase video file extensions
+
+    Returns:
+        str: SHA-1 hex digest of the sorted extensions
+
+    Raises:
+        None
+    """
+    return hashlib.sha1(
+        ' '.join(sorted(extensions)).encode('utf-8')).hexdigest()
+
+
+def _load_checkpoint(settings):
+    """Load the checkpoint of an unfinished crawl
+
+    Restores the crawler counters saved with the checkpoint. Directories
+    of folders which are no longer configured are dropped.
+
+    Args:
+        settings(SettingsSnapshot): settings for this crawl
+
+    Returns:
+        set: (root, absolute path) of directories not yet crawled,
+            empty if there is no checkpoint for the movie folder
+
+    Raises:
+        None
+    """
+    checkpoint = CrawlCheckpoint.get_solo()
+    relpaths = json.loads(checkpoint.frontier)
+    folders = settings.movie_folders
+    if not relpaths or checkpoint.movie_folder != settings.movie_folder:
+        log.info('no checkpoint to resume crawl from')
+        return set()
+    _COUNTERS.FILES_EVALUATED = checkpoint.files_evaluated
+    _COUNTERS.MOVIES_FOUND = checkpoint.movies_found
+    _COUNTERS.MOVIES_ADDED = checkpoint.movies_added
+    log.info('resume crawl with %s directories from %s' % (
+        len(relpaths), checkpoint.updated))
+    return set(
+        (root, path.normpath(path.join(folders[root], relpath)))
+        for root, relpath in relpaths
+        if root in folders
     )
-    log.info('crawl movie folder path : %s' % movie_folder_path)
-    files_evaluated = 0
-    movies_found = 0
-    movies_added = 0
-    for root, dirs, files in walk(movie_folder_path):
-        for filename in files:
-            files_evaluated += 1
-            crawler_status('FILES_EVALUATED', files_evaluated)
-            if not crawler_status():
+
+
+def _save_checkpoint(settings, frontier):
+    """Save the checkpoint of an unfinished crawl
+
+    Args:
+        settings(SettingsSnapshot): settings for this crawl
+        frontier(iterable): (root, absolute path) of directories not
+            yet crawled, empty when the crawl is complete
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    checkpoint = CrawlCheckpoint.get_solo()
+    checkpoint.movie_folder = settings.movie_folder
+    folders = settings.movie_folders
+    checkpoint.frontier = json.dumps(sorted(
+        [root, path.relpath(dirpath, folders[root])]
+        for root, dirpath in frontier
+    ))
+    checkpoint.files_evaluated = _COUNTERS.FILES_EVALUATED
+    checkpoint.movies_found = _COUNTERS.MOVIES_FOUND
+    checkpoint.movies_added = _COUNTERS.MOVIES_ADDED
+    checkpoint.save()
+    log.info('checkpoint with %s directories' % len(frontier))
+
+
+def walk_folders(
+        tops,
+        extensions,
+        workers=_CRAWL_WORKERS,
+        snapshot=None,
+        running=crawler_status,
+        throttles=None,
+        idle=None,
+        exclude=()):
+    """Walk directory trees with pools of scandir workers
+
+    The directories to walk are grouped by the device they are on, and
+    each device gets its own pending queue and group of workers, so that
+    disks are listed concurrently without sharing threads. Workers put
+    the subdirectories they find back on the pending queue of their
+    group. Every listed directory is handed back to the caller as a
+    single batch, so that database access stays on the calling thread.
+
+    Args:
+        tops(list): (root, absolute path) of the directories to walk
+        extensions(frozenset): lowercase video file extensions, the
+            size is looked up only for files having one of these
+        workers(int): number of threads listing directories on each
+            device
+        snapshot(dict): absolute directory path -> (mtime, inode) of
+            a previous crawl, directories matching it are not listed
+        running(function): returns False once the walk should stop,
+            the crawler status by default
+        throttles(Throttles): limits on listing directories for each
+            device, no limits if None
+        idle(tuple): (seconds, function), the function is called on
+            the calling thread whenever no directory is listed for
+            that many seconds
+        exclude(frozenset): normalized absolute paths of directories
+            which are not walked as subdirectories, such as movie
+            folders nested in another one, which are walked as tops
+            of their own root
+
+    Yields:
+        tuple(root, dirpath, files, state, subdirs):
+            root(str): root of the folder being walked
+            dirpath(str): absolute path of the listed directory
+            files(list): (filename, size, inode) tuples, size and
+                inode are None for files which are not videos
+                None if the directory is unchanged
+            state(tuple): (mtime, inode) of the directory, mtime is 0
+                if it holds video files which may still be copied
+                None if it could not be read
+            subdirs(list): absolute paths of subdirectories, which
+                are yielded after their parent
+
+    Raises:
+        None
+    """
+    batches = Queue.Queue()
+    snapshot = snapshot or {}
+    # subdirectories of unchanged directories are known from snapshot
+    children = {}
+    for dirpath in snapshot:
+        children.setdefault(path.dirname(dirpath), []).append(dirpath)
+
+    def scan(pending):
+        """Worker: list directories from pending until told to stop
+        """
+        while True:
+            item = pending.get()
+            if item is None:
                 return
-            name, ext = path.splitext(filename)
-            if ext not in _VIDEO_FILETYPES:
-                continue
+            root, dirpath = item
+            try:
+                # skip listing when the crawler has been stopped
+                # so that the pending queue drains quickly
+                if running():
+                    if throttles is None:
+                        batch = _scan(
+                            dirpath, extensions, snapshot, children)
+                    else:
+                        throttle = throttles.for_root(root)
+                        with throttle.limit:
+                            batch = _scan(
+                                dirpath, extensions, snapshot, children,
+                                throttle)
+                    if exclude:
+                        batch = batch[:3] + ([
+                            subdir for subdir in batch[3]
+                            if subdir not in exclude], )
+                    # the batch goes first, so that a directory is
+                    # always yielded before its subdirectories
+                    batches.put((root, ) + batch)
+                    for subdir in batch[3]:
+                        pending.put((root, subdir))
+            except Exception:
+                log.error('error listing %s' % dirpath)
+                log.error(traceback.format_exc())
+            finally:
+                pending.task_done()
 
-            filepath = path.join(root, filename)
-            size = stat(filepath).st_size
-            if size < _MOVIE_SIZE_THRESHOLD:
-                continue
+    def finish(pending):
+        """Signal the end of a group once all its directories are listed
+        """
+        pending.join()
+        for i in range(workers):
+            pending.put(None)
+        batches.put(None)
+
+    groups = {}
+    for root, top in tops:
+        try:
+            device = stat(top).st_dev
+        except OSError:
+            device = None
+        groups.setdefault(device, []).append((root, path.normpath(top)))
+    for device, group in groups.iteritems():
+        pending = Queue.Queue()
+        for item in group:
+            pending.put(item)
+        for i in range(workers):
+            thread = threading.Thread(target=scan, args=(pending, ))
+            thread.daemon = True
+            thread.start()
+        thread = threading.Thread(target=finish, args=(pending, ))
+        thread.daemon = True
+        thread.start()
+        log.debug('walking %s directories on device %s with %s workers' % (
+            len(group), device, workers))
 
-            movies_found += 1
-            crawler_status('MOVIES_FOUND', movies_found)
-            relpath = path.relpath(
-                filepath,
-                path.join(
-                    HDDRoot.get_solo().path,
-                    MovieFolder.get_solo().relpath,
-                ),
-            )
-            log.debug('movie found at %s' % relpath)
-
-            if _movie_exists_with_relpath(relpath):
-                log.debug('%s exists in db' % relpath)
+    # groups still walking, running is the status checked by workers
+    walking = len(groups)
+    while walking:
+        try:
+            if idle is None:
+                batch = batches.get()
+            else:
+                batch = batches.get(timeout=idle[0])
+        except Queue.Empty:
+            idle[1]()
+            continue
+        if batch is None:
+            walking -= 1
+            continue
+        yield batch
+
+
+def _scan(dirpath, extensions, snapshot, children, throttle=None):
+    """List a single directory
+
+    Symbolic links to directories are not followed (same as os.walk).
+    The stat result cached on the directory entry is used for file
+    sizes. A directory matching its snapshot is not listed, and its
+    known subdirectories from the snapshot are returned instead. A
+    directory holding video files which may still be copied gets an
+    mtime of 0 in its state, see _SETTLE_TIME, so that it never matches.
+
+    Args:
+        dirpath(str): absolute path of the directory
+        extensions(frozenset): lowercase video file extensions
+        snapshot(dict): see walk_folders
+        children(dict): absolute directory path -> list of absolute
+            paths of its subdirectories in snapshot
+        throttle(DeviceThrottle): limits on stat operations of the
+            device, no limits if None
+
+    Returns:
+        tuple(dirpath, files, state, subdirs): see walk_folders
+
+    Raises:
+        None
+    """
+    try:
+        if throttle is None:
+            dirstat = stat(dirpath)
+        else:
+            dirstat = throttle.stat(dirpath)
+    except OSError:
+        log.warning('%s could not be read' % dirpath)
+        return dirpath, [], None, []
+    previous = snapshot.get(dirpath)
+    if previous is not None and \
+            previous[:2] == (dirstat.st_mtime, dirstat.st_ino):
+        return dirpath, None, previous, children.get(dirpath, [])
+
+    files = []
+    subdirs = []
+    settled = time.time() - _SETTLE_TIME
+    mtime = dirstat.st_mtime
+    try:
+        listing = scandir(dirpath)
+    except OSError:
+        log.warning('%s could not be listed' % dirpath)
+        return dirpath, files, None, subdirs
+    for entry in listing:
+        try:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
                 continue
+            if path.splitext(entry.name)[1].lower() not in extensions:
+                files.append((entry.name, None, None))
+                continue
+            if throttle is None:
+                entry_stat = entry.stat()
+            else:
+                entry_stat = throttle.entry_stat(entry)
+            files.append((entry.name, entry_stat.st_size, entry_stat.st_ino))
+            if entry_stat.st_size < MOVIE_SIZE_THRESHOLD or \
+                    entry_stat.st_mtime >= settled:
+                mtime = 0.0
+        except OSError:
+            # broken links, or files removed while listing
+            log.warning('%s could not be read' % entry.path)
+    return (
+        dirpath,
+        files,
+        (mtime, dirstat.st_ino),
+        subdirs,
+    )
 
-            movie = Movie()
-            movie.title = filename_clean(name)
-            movie.relpath = relpath
-            movie.save()
-            movies_added += 1
-            log.info('%s added to database' % movie.title)
-            crawler_status('MOVIES_ADDED', movies_added)
-    crawler_status('STATUS', False)
 
+def video_extensions():
+    """Video file extensions used by a crawl
+
+    Compiles the default video file extensions and the extensions
+    configured in database into a set of lowercase extensions. The
+    configured extensions are added to the defaults, so that adding
+    one does not drop the others, and every movie along with them.
+
+    Args:
+        None
+
+    Returns:
+        frozenset: lowercase file extensions including leading dot
+
+    Raises:
+        None
+    """
+    extensions = list(_VIDEO_FILETYPES)
+    extensions.extend(
+        VideoExtension.objects.values_list('extension', flat=True))
+    extensions = frozenset(extension.lower() for extension in extensions)
+    log.info('crawl using %s video extensions' % len(extensions))
+    return extensions
+
+
+def _known_movies():
+    """Paths and fingerprints of all movies in database
+
+    Loaded once per crawl, so that movies found on disk are checked
+    against memory instead of querying the database for each file.
+
+    Args:
+        None
+
+    Returns:
+        tuple(known_relpaths, sizes):
+            known_relpaths(set): (root, relpath) of movies, relpath
+                from their root
+            sizes(dict): file size -> list of (pk, root, relpath,
+                inode, filehash) of movies with that size, used to
+                match renamed or moved files, see match_moved
+
+    Raises:
+        None
+    """
+    known_relpaths = set()
+    sizes = {}
+    for movie in Movie.objects.values_list(
+            'pk', 'root', 'relpath', 'filesize', 'inode',
+            'filehash').iterator():
+        pk, root, relpath, filesize, inode, filehash = movie
+        if (root, relpath) in known_relpaths:
+            log.warning('%s duplicates exist in database' % relpath)
+        known_relpaths.add((root, relpath))
+        if filesize:
+            sizes.setdefault(filesize, []).append(
+                (pk, root, relpath, inode, filehash))
+    log.info('%s movie paths loaded from database' % len(known_relpaths))
+    return known_relpaths, sizes
+
+
+def match_moved(settings, candidates, inode=None, filehash=None):
+    """Find the movie a new file was renamed or moved from
+
+    A candidate matches if it has the same inode or the same
+    OpenSubtitles hash, and its file no longer exists.
+
+    Args:
+        settings(SettingsSnapshot): settings for this crawl
+        candidates(list): (pk, root, relpath, inode, filehash) of
+            movies in database with the size of the new file
+        inode(int): inode number of the new file
+        filehash(str): OpenSubtitles hash of the new file
+
+    Returns:
+        tuple: the matching candidate
+        None: if no candidate matches
+
+    Raises:
+        None
+    """
+    for candidate in candidates or ():
+        pk, root, relpath, known_inode, known_hash = candidate
+        if (inode and known_inode == inode) or \
+                (filehash and known_hash == filehash):
+            if not path.exists(settings.movie_path(relpath, root)):
+                return candidate
+    return None
+
+
+def move_movie(candidate, root, relpath, inode):
+    """Update the path of a renamed or moved movie
+
+    Args:
+        candidate(tuple): (pk, root, relpath, inode, filehash) of
+            the movie, see match_moved
+        root(str): new root of the movie
+        relpath(str): new relative path of the movie from its root
+        inode(int): new inode number of the movie file
+
+    Returns:
+        None
 
-def _movie_exists_with_relpath(relpath):
+    Raises:
+        None
+    """
+    Movie.objects.filter(pk=candidate[0]).update(
+        root=root, relpath=relpath, inode=inode, missing=False)
+    log.info('%s moved to %s' % (candidate[2], relpath))
+
+
+def _movie_exists_with_relpath(relpath, known_relpaths, root=''):
     """Check Movie exists in database by its relative path
 
     Args:
-        relpath(str): relative path of file from Movie Folder
+        relpath(str): relative path of file from its root
+        known_relpaths(set): (root, relpath) of movies in database
+        root(str): root of the file, '' for the movie folder
 
     Returns:
         bool: True if found, False otherwise
     """
 
     assert type(relpath) == str or type(relpath) == unicode
-    assert path.isfile(
-        path.join(
-            HDDRoot.get_solo().path,
-            MovieFolder.get_solo().relpath,
-            relpath,
-        )
-    )
 
-    count = Movie.objects.filter(relpath=relpath).count()
+    return (root, relpath) in known_relpaths
 
-    if count > 1:
-        print 'Found movie, and duplicates (relpath) exist.'
-        log.warning('%s duplicates exist in database' % relpath)
-        return True
 
-    if count == 1:
-        return True
+def parse_filename(filename, debug=False):
+    """Parse title, year and release tags of a filename
 
-    return False
+    See movie_metadata.release for the tokenizer.
+
+    Recently parsed names are remembered in two generations of
+    _CLEAN_CACHE_SIZE / 2 entries: a name used again moves to the
+    current generation, and the older generation is dropped when the
+    current one is full. This keeps the least recently used names out
+    without the cost of ordering every entry, and plain dict access
+    needs no lock between the crawler and the watcher threads.
+
+    Args:
+        filename(str): filename without extension
+        debug(bool): print the parsed release, skips the cache
+
+    Returns:
+        ReleaseInfo: title, year, resolution, source and codec
+
+    Raises:
+        None
+    """
+    release = None
+    if not debug:
+        release = _CLEAN_CACHE[0].get(filename)
+        if release is not None:
+            return release
+        release = _CLEAN_CACHE[1].get(filename)
+    if release is None:
+        release = parse_release(filename)
+        if debug:
+            print release
+        log.debug('%s parsed to %s' % (filename, release))
+    if len(_CLEAN_CACHE[0]) >= _CLEAN_CACHE_SIZE // 2:
+        _CLEAN_CACHE[1] = _CLEAN_CACHE[0]
+        _CLEAN_CACHE[0] = {}
+    _CLEAN_CACHE[0][filename] = release
+    return release
 
 
 def filename_clean(filename, debug=False):
@@ -277,6 +1397,7 @@ def filename_clean(filename, debug=False):
 
     Args:
         filename(str): filename
+        debug(bool): print the parsed release, skips the cache
 
     Returns:
         name(str): cleaned filename
@@ -284,26 +1405,4 @@ def filename_clean(filename, debug=False):
     Raises:
         None
     """
-    # TODO: refactor regex expressions and cleaning functios
-    patterns = (
-        # TODO: specify examples of each pattern
-        # TODO: ordered set of patterns, dictionary keys are random
-        (
-            r"([\w\s\.\-']+)[\d\(\)\[\]]{4,6}.*[\dp]{4,5}.*",
-            lambda s: s[0]
-        ),
-        (r"([\w\s\-\.']+)[\d\(\)\[\]]{4,6}", lambda s: s[0]),
-        # This-is.a Movie (year) or [year].more-text here
-        (r"([\w\s\.\-']+)[\d\(\)\[\]]{4,6}.*", lambda s: s[0]),
-    )
-    for pattern, extract in patterns:
-        regexres = re.match(pattern, filename)
-        if regexres:
-            if debug:
-                print pattern
-            name = extract(regexres.groups())
-            name = ' '.join(name.split('.')).strip()
-            log.info('%s cleaned to %s using %s' % (filename, name, pattern))
-            return name
-    name = ' '.join(filename.split('.')).strip()
-    return filename
+    return parse_filename(filename, debug).title
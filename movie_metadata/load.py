@@ -24,6 +24,13 @@
         requires a key for their API use. The key is set via the
         tmdb_set_key method in the module code.
 
+    HTTP:
+        OMDb, TMDb and IMDb are queried through the pooled session of
+        movie_metadata.client, except for the TMDb searches made by
+        tmdbsimple, which sends its own requests. Responses are kept
+        on disk by movie_metadata.cache, and used again by later runs.
+        Requests to each provider are rate limited, and stopped for a
+        while when the provider keeps failing, see _request.
 """
 
 # TODO: check which service is online and use that
@@ -35,32 +42,43 @@
 # TODO: see IMDBPie https://github.com/richardasaurus/imdb-pie
 # TODO: see imdbpy http://imdbpy.sourceforge.net
 # TODO: use only if API keys are not empty
-# TODO: use opensub_initiate to get token within threads
 
 from __future__ import unicode_literals
 
 from os import path
 from datetime import datetime
-import json
+from datetime import timedelta
+import hashlib
 import Queue
 from threading import Thread
 from threading import Lock
-import urllib2
+from threading import local
 import re
+import socket
 from xmlrpclib import ProtocolError
 import logging
 import traceback
 
-from pythonopensubtitles.opensubtitles import OpenSubtitles
 from pythonopensubtitles.utils import File
+import requests
 import tmdbsimple as tmdb
 
-from hdd_settings.models import HDDRoot
-from hdd_settings.models import MovieFolder
+from django.utils import timezone
+
+from hdd_settings.models import settings_snapshot
+from movie_metadata.cache import cached
+from movie_metadata.cache import normalize_query
+from movie_metadata.cache import response_cache
+from movie_metadata.client import CircuitBreaker
+from movie_metadata.client import CircuitOpen
+from movie_metadata.client import get_json
+from movie_metadata.models import LoadFailure
 from movie_metadata.models import Movie
-from hdd_settings.models import TMDbKey
-from hdd_settings.models import OpenSubKey
 from movie_metadata.movie import save as movie_save
+from movie_metadata.opensub import HashBatcher
+from movie_metadata.opensub import LoginFailed
+from movie_metadata.opensub import SessionPool
+from movie_metadata.throttle import TokenBucket
 
 
 _ERROR = {
@@ -70,10 +88,81 @@ _ERROR = {
 """Crawler Error messages
 """
 
+_LOAD_WORKERS = 5
+"""Number of movies downloaded concurrently by the loader
+"""
+
+_LOG_INTERVAL = 50
+"""Number of movies processed between two progress lines in the log
+"""
+
+_PROVIDER_RATES = {
+    'omdb': 10,
+    'tmdb': 4,
+    'imdb': 5,
+    'opensub': 4,
+}
+"""Provider -> requests per second, TMDb and OpenSubtitles allow 40
+requests every 10 seconds
+"""
+
+_BREAKER_THRESHOLD = 5
+"""Failed requests in a row after which a provider is not used
+"""
+
+_BREAKER_RESET = 60  # seconds
+"""Time after which a provider which failed is tried again
+"""
+
+_FILE_FIELDS = (
+    'relpath', 'root', 'filehash', 'filesize', 'inode', 'year', 'parts',
+)
+"""Movie fields found by the crawler, kept when the loader replaces a
+movie with the one saved from its metadata
+"""
+
+_RETRY_DELAY = 24 * 60 * 60  # seconds
+"""Time before a movie which could not be identified is tried again,
+doubled with each failure
+"""
+
+_RETRY_MAX_DELAY = 64 * _RETRY_DELAY
+"""Longest time before a movie which could not be identified is tried
+again
+"""
+
 log = logging.getLogger('load')
 log.info(72 * '-')
 log.info("load module loaded")
 
+_PROVIDERS = dict(
+    (provider, (
+        TokenBucket(rate),
+        CircuitBreaker(provider, _BREAKER_THRESHOLD, _BREAKER_RESET)))
+    for provider, rate in _PROVIDER_RATES.iteritems()
+)
+"""Provider -> (TokenBucket, CircuitBreaker) shared by loader threads
+"""
+
+_OPENSUB = {}
+"""Shared OpenSubtitles batcher, created on first use
+"""
+
+_OPENSUB_LOCK = Lock()
+"""Lock for creating or replacing the OpenSubtitles batcher
+"""
+
+_LOOKUP = local()
+"""Lookup of the current loader thread, unavailable is set when a
+provider could not answer one of its requests, and refresh when its
+responses are not taken from the response cache
+"""
+
+
+class _Unavailable(Exception):
+    """A movie was not found while a provider could not be reached
+    """
+
 
 def loader_status(key=None, value=None):
     """Loader status
@@ -111,14 +200,28 @@ def loader_status(key=None, value=None):
     return _LOADER['STATUS']
 
 
-def _run():
+def _run(settings=None, workers=_LOAD_WORKERS):
     """Run the loader
 
     Downloads metadata from online sources for movies in database.
-    Uses Queue for concurrent access using parallel threads.
+
+    A feeder thread puts movies in a bounded job queue, from which
+    a pool of worker threads downloads metadata as soon as they are
+    free, so a slow request only holds up its own worker. Results are
+    saved to database on this thread: when movies are saved from
+    within threads, SQLite throws concurrency errors since it cannot
+    handle so many locks. Status counters are also only updated here.
+
+    Movies which could not be identified by a previous run are not
+    queued until their retry time, see _failed, and are then looked up
+    without the response cache, which would only replay the misses of
+    the previous run. Movies skipped because a provider was unavailable
+    are tried again by the next run.
 
     Args:
-        None
+        settings(SettingsSnapshot): settings for this run,
+            current settings if None
+        workers(int): number of movies downloaded concurrently
 
     Returns:
         None
@@ -126,47 +229,64 @@ def _run():
     Raises:
         None
     """
-    # TODO: wrap the entire func in try block
-    tmdb.API_KEY = TMDbKey.get_solo().key
-    t_size = 5  # size of thread, and movie queue
-    # download job queue
-    q = Queue.LifoQueue()
-    # movies to be saved to database
+    if settings is None:
+        settings = settings_snapshot()
+    tmdb.API_KEY = settings.tmdb_key
+    workers = max(1, workers)
+    # a hash search is sent as soon as every worker waits on it
+    _opensub_batcher(settings).threads = workers
+    # download job queue, bounded so that movies are fed as workers
+    # become free
+    q = Queue.Queue(maxsize=2 * workers)
+    # (movie, metadata, not found) to be saved to database, None from
+    # each worker when it is done
     m = Queue.Queue()
-    # skipped movies
-    movies = list(Movie.objects.all())
-    log.info('started load run with %s movies' % len(movies))
-    m_start = 0
+    movies = list(Movie.objects.filter(missing=False))
+    failures = dict(
+        (key, (count, retry_after)) for key, count, retry_after in
+        LoadFailure.objects.values_list('key', 'failures', 'retry_after'))
+    now = timezone.now()
+    waiting = len(movies)
+    movies = [
+        movie for movie in movies
+        if failures.get(_failure_key(movie), (0, now))[1] <= now
+    ]
+    waiting -= len(movies)
+    if waiting:
+        log.info('%s movies not identified before, waiting to retry' % (
+            waiting))
+    log.info('started load run with %s movies, %s workers' % (
+        len(movies), workers))
     loader_status('MOVIES_EVALUATED', 0)
     loader_status('METADATA_DOWNLOADED', 0)
     loader_status('MOVIES_SKIPPED', 0)
 
-    m_list = movies[m_start:m_start + t_size]
-    while m_list:
-        if loader_status('STATUS') is False:
-            break
-        for movie in m_list:
-            # initialize the job queue
-            log.debug('%s queued' % movie.title)
-            q.put(movie)
-
-        log.debug('starting %s threads' % t_size)
-        for i in range(t_size):
-            # start threads
-            thread = Thread(target=_load, args=(q, m))
-            thread.daemon = True
-            thread.start()
-
-        # wait for threads to finish
-        q.join()
-
-        while not m.empty():
-            # save movies to database
-            # When movies are saved from within threads, SQLite throws
-            # concurrency errors since it cannot handle so many locks
-            # An alternate solution is to download the data usnig threads,
-            # and then to save movies in a single thread.
-            movie, data = m.get()
+    feeder = Thread(target=_feed, args=(q, movies, workers))
+    feeder.daemon = True
+    feeder.start()
+    for i in range(workers):
+        thread = Thread(target=_load, args=(q, m, settings, failures))
+        thread.daemon = True
+        thread.start()
+
+    evaluated = downloaded = skipped = 0
+    running = workers
+    while running:
+        result = m.get()
+        if result is None:
+            running -= 1
+            continue
+        movie, data, not_found = result
+        evaluated += 1
+        if data is None:
+            skipped += 1
+            loader_status('SKIPPED_LIST', movie.title)
+            if not_found:
+                _failed(movie, failures)
+        else:
+            downloaded += 1
+            if _failure_key(movie) in failures:
+                LoadFailure.objects.filter(key=_failure_key(movie)).delete()
             movie.delete()
             try:
                 movie_save(data)
@@ -174,30 +294,254 @@ def _run():
             except Exception:
                 log.error('error saving %s to database.' % data['title'])
                 log.error(traceback.format_exc())
-                loader_status('SKIPPED', movie.title)
+                loader_status('SKIPPED_LIST', movie.title)
                 log.debug('%s put in skipped list' % movie.title)
-                # movie.save()
-            m.task_done()
+        loader_status('MOVIES_EVALUATED', evaluated)
+        loader_status('METADATA_DOWNLOADED', downloaded)
+        loader_status('MOVIES_SKIPPED', skipped)
+        if evaluated % _LOG_INTERVAL == 0:
+            log.info('%s items processed of %s' % (evaluated, len(movies)))
+
+    log.info('%s items processed of %s' % (evaluated, len(movies)))
+    cache = response_cache()
+    if cache is not None:
+        cache.flush()
+        log.info('response cache: %s hits, %s misses, %s bytes' % (
+            cache.hits, cache.misses, cache.size))
+    loader_status('STATUS', False)
 
-        log.info('%s items processed of %s' % (
-            len(m_list) + m_start, len(movies)
-        ))
-        m_start += t_size
-        m_list = movies[m_start:m_start + t_size]
 
-    loader_status('STATUS', False)
+def _request(provider, fetch):
+    """Send a request to a provider within its limits
+
+    Waits for a token of the provider, and fails at once while its
+    circuit breaker is open, see movie_metadata.client. Network
+    errors, timeouts, server errors and rate limit responses count as
+    failures of the provider. Both mark the lookup of the current
+    thread as unavailable, see _movie_metadata.
+
+    Args:
+        provider(str): name of the provider, see _PROVIDER_RATES
+        fetch(function): sends the request and returns the response
+
+    Returns:
+        response returned by fetch
+
+    Raises:
+        CircuitOpen: the provider failed too many times in a row
+        exceptions raised by fetch
+    """
+    bucket, breaker = _PROVIDERS[provider]
+    try:
+        breaker.allow()
+    except CircuitOpen:
+        _LOOKUP.unavailable = True
+        raise
+    bucket.take()
+    try:
+        response = fetch()
+    except Exception as e:
+        if _is_outage(e):
+            breaker.failure()
+            _LOOKUP.unavailable = True
+        else:
+            breaker.success()
+        raise
+    breaker.success()
+    return response
+
+
+def _is_outage(error):
+    """Check whether an error means a provider is unavailable
+
+    Args:
+        error(Exception): error raised by a request
+
+    Returns:
+        bool: True for network errors, timeouts, server errors and
+            rate limit responses
+
+    Raises:
+        None
+    """
+    if isinstance(error, requests.HTTPError):
+        response = error.response
+        return response is None or \
+            response.status_code >= 500 or response.status_code == 429
+    if isinstance(error, ProtocolError):
+        return error.errcode >= 500 or error.errcode == 429
+    return isinstance(error, (requests.RequestException, socket.error))
+
+
+def _fetch(provider, query, fetch, keep=None):
+    """Response of a provider, from the response cache if possible
+
+    Args:
+        provider(str): name of the provider, see _PROVIDER_RATES
+        query(str): query sent to the provider
+        fetch(function): sends the request and returns the response
+        keep(function): called with the response, returns False if it
+            is not to be cached, see movie_metadata.cache.cached
+
+    Returns:
+        JSON document of the response
+
+    Raises:
+        CircuitOpen: the provider failed too many times in a row
+        exceptions raised by fetch
+    """
+    return cached(
+        provider, query, lambda: _request(provider, fetch), keep,
+        getattr(_LOOKUP, 'refresh', False))
+
+
+def _omdb_found(data):
+    """Check that an OMDb response is not an error
+
+    Args:
+        data(dict): JSON document of the response
+
+    Returns:
+        bool: False for errors, such as "Movie not found!"
+
+    Raises:
+        None
+    """
+    return data.get('Response') != 'False' and not data.get('Error')
+
+
+def _tmdb_found(data):
+    """Check that a TMDb search or find response has results
+
+    Args:
+        data(dict): JSON document of the response
+
+    Returns:
+        bool: False if nothing was found
+
+    Raises:
+        None
+    """
+    if 'total_results' in data:
+        return data['total_results'] > 0
+    if 'movie_results' in data:
+        return bool(data['movie_results'])
+    return True
+
+
+def _failure_key(movie):
+    """Key of a movie in LoadFailure
+
+    Args:
+        movie(Movie): movie to be processed
+
+    Returns:
+        str: OpenSubtitles hash and normalized title of the movie, a
+            hash of its root and relpath when it has no OpenSubtitles
+            hash, so that files sharing a title are not retried
+            together
+
+    Raises:
+        None
+    """
+    filehash = movie.filehash
+    if not filehash:
+        filehash = 'path:' + hashlib.sha1(
+            ('%s\0%s' % (movie.root, movie.relpath)).encode('utf-8'),
+        ).hexdigest()[:16]
+    return ('%s|%s' % (filehash, normalize_query(movie.title)))[:255]
+
+
+def _failed(movie, failures):
+    """Record a movie which could not be identified
+
+    The movie is not tried again for _RETRY_DELAY, doubled for every
+    previous failure, up to _RETRY_MAX_DELAY.
+
+    Args:
+        movie(Movie): movie which could not be identified
+        failures(dict): key -> (failures, retry_after) of the movies
+            which failed before this run
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    count = failures.get(_failure_key(movie), (0, None))[0] + 1
+    delay = min(_RETRY_MAX_DELAY, _RETRY_DELAY * 2 ** (count - 1))
+    LoadFailure.objects.update_or_create(
+        key=_failure_key(movie),
+        defaults={
+            'title': movie.title,
+            'failures': count,
+            'retry_after': timezone.now() + timedelta(seconds=delay),
+        })
+    log.debug('%s not retried for %s seconds' % (movie.title, delay))
+
+
+def file_fields(movie):
+    """Fields of a movie found by the crawler
+
+    The loader deletes a movie and saves it again from its metadata,
+    so these fields are added to the metadata to be kept, see
+    movie_metadata.movie.save.
+
+    Args:
+        movie(Movie): movie in database
+
+    Returns:
+        dict: field name -> value, see _FILE_FIELDS
+
+    Raises:
+        None
+    """
+    return dict((field, getattr(movie, field)) for field in _FILE_FIELDS)
+
 
+def _feed(q, movies, workers):
+    """Feed movies to the download job queue
 
-def _load(q, m):
+    Stops feeding when the loader is turned off, and then puts a None
+    for each worker to tell it there are no more movies.
+
+    Args:
+        q(Queue): movie object queue to be processed
+        movies(list): movie objects to be processed
+        workers(int): number of worker threads
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    for movie in movies:
+        if not loader_status('STATUS'):
+            log.info('loader turned off, movies not queued')
+            break
+        log.debug('%s queued' % movie.title)
+        q.put(movie)
+    for i in range(workers):
+        q.put(None)
+
+
+def _load(q, m, settings, failures):
     """Load metadata from online sources
 
-    Gets a movie from the job q,
+    Gets movies from the job q until it gets None,
     Downloads JSON from online, parses it,
-    and saves it to the movie save queue m.
+    and puts it in the movie save queue m.
 
     Args:
         q(Queue): movie object queue to be processed
-        m(Queue): movie object queue to be saved
+        m(Queue): (movie, metadata, not found) queue to be saved,
+            metadata is None for skipped movies, not found is True
+            when the providers answered that they do not know it
+        settings(SettingsSnapshot): settings for this run
+        failures(dict): key -> (failures, retry_after) of the movies
+            which failed before this run, see _failed
 
     Returns:
         None
@@ -205,130 +549,129 @@ def _load(q, m):
     Raises:
         None
     """
-    while not q.empty():
+    while True:
+        movie = q.get()
+        if movie is None:
+            m.put(None)
+            return
         if not loader_status('STATUS'):
             # loader has been turned off
-            log.info('loader turned off, dumping movies in queue')
-            while not q.empty():
-                movie = q.get()
-                log.info('%s dumped' % movie.title)
-                q.task_done()
-            return
-        # get a movie object from q
-        movie = q.get()
+            log.info('%s dumped' % movie.title)
+            continue
         log.debug('processing movie: %s' % movie.title)
-
-        data = None
-        if movie.imdb_id is not None:
-            # get metadata by imdb id
-            log.debug('movie: %s by imdb id: %s' % (
-                movie.title, movie.imdb_id)
-            )
-            data = movie_metadata_by_imdb_id(movie.imdb_id)
+        not_found = False
+        try:
+            data = _movie_metadata(
+                movie, settings, _failure_key(movie) in failures)
+            not_found = data is None
+        except _Unavailable:
+            log.info('movie: %s provider unavailable' % movie.title)
+            data = None
+        except Exception:
+            log.error('movie: %s error occured' % movie.title)
+            log.error(traceback.format_exc())
+            data = None
         if data is None:
-            # get metadata by title (or filename)
-            # can also mean imdb id is not available
-            log.debug('movie: %s by title' % movie.title)
-            data = movie_metadata_by_title(movie.title)
-        if data is not None:
-            # movie has metadata
-            data['relpath'] = movie.relpath
-            log.info('movie: %s metadata received' % movie.title)
-            m.put((movie, data))
-            loader_status(
-                'MOVIES_EVALUATED',
-                loader_status('MOVIES_EVALUATED') + 1
-            )
-            loader_status(
-                'METADATA_DOWNLOADED',
-                loader_status('METADATA_DOWNLOADED') + 1
-            )
-        else:
-            # movie metadata could not be downloaded
-            # use opensub to try and identify the movie
-            imdb_id = opensub(movie.relpath)
-            if imdb_id is None:
-                # opensub could not identify the movie
-                # print movie.title, ' SKIPPED.'
-                log.warning('movie: %s skipped' % movie.title)
-                loader_status(
-                    'MOVIES_EVALUATED',
-                    loader_status('MOVIES_EVALUATED') + 1
-                )
-                loader_status(
-                    'MOVIES_SKIPPED',
-                    loader_status('MOVIES_SKIPPED') + 1
-                )
-                loader_status('SKIPPED_LIST', movie.title)
+            log.warning('movie: %s skipped' % movie.title)
+        m.put((movie, data, not_found))
 
-            else:
-                # opensub identified movie
-                movie.imdb_id = imdb_id
-                log.info('movie: %s got opensub imdb id: %s' % (
-                    movie.title, movie.imdb_id
-                ))
-                # put it back in the queue to download its metadata
-                # the next time a thread retrieves it
-                q.put(movie)
-        q.task_done()
 
+def _movie_metadata(movie, settings, refresh=False):
+    """Metadata of a movie from online sources
+
+    Searches by IMDb ID if known, then by title. When both fail,
+    OpenSubtitles is used to identify the movie by its hash, and its
+    metadata is searched by the IMDb ID found.
 
-def opensub_initiate():
-    """OpenSubtitles initiation for use
+    The search functions log and swallow their errors, so a request
+    which failed because its provider was unavailable is noted on the
+    lookup of the thread by _request, and a movie which was not found
+    during such a lookup is not reported as unknown.
+
+    Args:
+        movie(Movie): movie to be processed
+        settings(SettingsSnapshot): settings for this run
+        refresh(bool): send every request to the providers, instead of
+            using the response cache
+
+    Returns:
+        dict: metadata of the movie, see movie_metadata_by_imdb_id
+        None: if the providers do not know the movie
+
+    Raises:
+        _Unavailable: the movie was not found, and a provider could not
+            be reached
+    """
+    _LOOKUP.unavailable = False
+    _LOOKUP.refresh = refresh
+    data = _identify(movie, settings)
+    if data is None and _LOOKUP.unavailable:
+        raise _Unavailable(movie.title)
+    return data
 
-    Login to OpenSubtitles using API to retrieve a token
-    for identifying movies.
 
-    Failure results in a null token.
-    Network errors are caused to service unavailability, or DNS problems
+def _identify(movie, settings):
+    """Metadata of a movie from online sources, see _movie_metadata
 
     Args:
-        None
+        movie(Movie): movie to be processed
+        settings(SettingsSnapshot): settings for this run
 
     Returns:
-        token(str): Authentication Token for OpenSubtitles
-        None: if token cannot be validated
+        dict: metadata of the movie, see movie_metadata_by_imdb_id
+        None: if the movie could not be identified
 
     Raises:
         None
     """
-    try:
-        # login to opensub using API
-        sub = OpenSubtitles()
-        token = sub.login(OpenSubKey.get_solo().uid, OpenSubKey.get_solo().key)
-        if not token:
-            # return sub
-            print 'null token'
-            log.error('open sub null token')
-            return
-        return sub
-    except ProtocolError as e:
-        # most likely network error or API server error
-        print "E: " + str(e)
-    except AssertionError:
-        print 'Failed to authenticate opensubtitles login.'
-    except ProtocolError as e:
-        """
-        TODO: gaierror:
-            [Errno 8] nodename nor servname provided, or not known
-        """
-        if e.errcode == 503:
-            # ProtocolError - 503 Service Unavailable
-            print 'Check network connection and try again.'
-        log.error('open sub error occured')
-        log.error(traceback.format_exc())
-    except Exception:
-        log.error('open sub error occured')
-        log.error(traceback.format_exc())
+    data = None
+    if movie.imdb_id is not None:
+        # get metadata by imdb id
+        log.debug('movie: %s by imdb id: %s' % (
+            movie.title, movie.imdb_id)
+        )
+        data = movie_metadata_by_imdb_id(movie.imdb_id, settings)
+    if data is None:
+        # get metadata by title (or filename)
+        # can also mean imdb id is not available
+        log.debug('movie: %s by title' % movie.title)
+        data = movie_metadata_by_title(movie.title, movie.year)
+    if data is None:
+        # use opensub to try and identify the movie
+        imdb_id = opensub(
+            movie.relpath, settings, movie.filehash, movie.filesize,
+            movie.root)
+        if imdb_id is None:
+            # opensub could not identify the movie
+            return None
+        movie.imdb_id = imdb_id
+        log.info('movie: %s got opensub imdb id: %s' % (
+            movie.title, movie.imdb_id
+        ))
+        data = movie_metadata_by_imdb_id(movie.imdb_id, settings)
+        if data is None:
+            return None
+    # movie has metadata
+    data.update(file_fields(movie))
+    log.info('movie: %s metadata received' % movie.title)
+    return data
 
 
-def opensub(relpath):
+def opensub(relpath, settings=None, filehash=None, filesize=None, root=''):
     """OpenSubtitle identification of movie
 
-    Uses the OpenSubtitles API to identify movie
+    Uses the OpenSubtitles API to identify movie. The movie file is
+    only opened when its hash has not been computed by the crawler.
+    The hash is searched together with the hashes of other loader
+    threads, see movie_metadata.opensub.HashBatcher.
 
     Args:
         relpath(str): relative path of movie file
+        settings(SettingsSnapshot): settings for this run,
+            current settings if None
+        filehash(str): OpenSubtitles hash of movie file
+        filesize(int): size of movie file in bytes
+        root(str): root of movie file, '' for the movie folder
 
     Returns:
         imdb_id(int): on success, returns idetified imdb id
@@ -337,58 +680,41 @@ def opensub(relpath):
     Raises:
         None
     """
-    if 'sub' not in opensub.__dict__:
-            sub = opensub_initiate()
-            if sub:
-                opensub.sub = sub
-                token = sub.login(
-                    OpenSubKey.get_solo().uid,
-                    OpenSubKey.get_solo().key
-                )
-                opensub.token = token
-            opensub.lock = Lock()
-
+    if settings is None:
+        settings = settings_snapshot()
     try:
-        # login to opensub using API
-        sub = opensub.sub
-        token = opensub.token
-        if not token:
-            # return sub
-            print 'null token'
-            log.error('path: %s open sub null token' % relpath)
-            return
         # check that the file is accessible
-        if not path.exists(path.join(
-            HDDRoot.get_solo().path,
-            MovieFolder.get_solo().relpath,
-            relpath,
-        )):
-            print "ERROR: " + relpath
-            log.error('path: %s does not exist' % relpath)
-            return
-        f = File(path.join(
-            HDDRoot.get_solo().path,
-            MovieFolder.get_solo().relpath,
-            relpath,
-        ))
-        if f is None:
-            log.error('path: %s open sub file error' % relpath)
-            return
-        hash = f.get_hash()
-        size = f.size
-        with opensub.lock:
-            data = sub.search_subtitles([{
-                'sublanguageid': 'all',
-                'moviehash': hash,
-                'moviebytesize': size,
-            }])
-        if type(data) is list:
-            if data[0].get('IDMovieImdb', None):
-                return data[0]['IDMovieImdb']
+        if filehash and filesize:
+            hash = filehash
+            size = filesize
         else:
-            log.warning('%s opensub failed to identify movie' % relpath)
+            filepath = settings.movie_path(relpath, root)
+            if not path.exists(filepath):
+                print "ERROR: " + relpath
+                log.error('path: %s does not exist' % relpath)
+                return
+            f = File(filepath)
+            if f is None:
+                log.error('path: %s open sub file error' % relpath)
+                return
+            hash = f.get_hash()
+            size = f.size
+        imdb_id = _opensub_batcher(settings).lookup(hash, size)
+        if imdb_id:
+            return imdb_id
+        log.warning('%s opensub failed to identify movie' % relpath)
+    except CircuitOpen:
+        # raised on the thread which sent the batch of the hash
+        _LOOKUP.unavailable = True
+        log.debug('path: %s opensub unavailable' % relpath)
+    except LoginFailed:
+        _LOOKUP.unavailable = True
+        print 'null token'
+        log.error('path: %s open sub null token' % relpath)
     except ProtocolError as e:
         # most likely network error or API server error
+        if _is_outage(e):
+            _LOOKUP.unavailable = True
         print "E: " + str(e)
     except AssertionError:
         print 'Failed to authenticate opensubtitles login.'
@@ -402,20 +728,56 @@ def opensub(relpath):
             print 'Check network connection and try again.'
         log.error('path: %s open sub error occured' % relpath)
         log.error(traceback.format_exc())
-    except Exception:
+    except Exception as e:
+        if _is_outage(e):
+            _LOOKUP.unavailable = True
         log.error('path: %s open sub error occured' % relpath)
         log.error(traceback.format_exc())
 
 
-def movie_metadata_by_title(movie_title):
+def _opensub_batcher(settings):
+    """Batcher of OpenSubtitles hash searches
+
+    The batcher and its pool of sessions are shared by the loader
+    threads, and replaced when the OpenSubtitles key changes, logging
+    out the sessions of the previous key.
+
+    Args:
+        settings(SettingsSnapshot): settings holding the API keys
+
+    Returns:
+        HashBatcher: batcher searching on sessions logged in with the
+            API keys
+
+    Raises:
+        None
+    """
+    with _OPENSUB_LOCK:
+        batcher = _OPENSUB.get('batcher')
+        if batcher is None or (batcher.pool.uid, batcher.pool.key) != (
+                settings.opensub_uid, settings.opensub_key):
+            if batcher is not None:
+                batcher.pool.close()
+            pool = SessionPool(
+                settings.opensub_uid, settings.opensub_key,
+                request=lambda send: _request('opensub', send))
+            batcher = HashBatcher(pool)
+            _OPENSUB['batcher'] = batcher
+        return batcher
+
+
+def movie_metadata_by_title(movie_title, year=None):
     """Retrieve movie metadata by title
 
     Searches for movies based on their title and retrieves their
     metadata from online sources. Uses TMDb as first choice,
-    failing which OMDb is queried.
+    failing which OMDb is queried. When the release year is known,
+    the search is restricted to it, and repeated without the year
+    if nothing is found.
 
     Args:
         movie_title(str): title of the movie to be searched
+        year(int): release year of the movie, if known
 
     Returns:
         movie(dict): a dictionary containing the movie metadata
@@ -440,7 +802,9 @@ def movie_metadata_by_title(movie_title):
     """
     assert type(movie_title) == str or type(movie_title) == unicode
     try:
-        movie = tmdb3_search_by_title(movie_title)
+        movie = tmdb3_search_by_title(movie_title, year)
+        if movie is None and year:
+            movie = tmdb3_search_by_title(movie_title)
         # if movie is None:
         #     movie = omdb_search_by_title(movie_title)
         return movie
@@ -449,7 +813,7 @@ def movie_metadata_by_title(movie_title):
     return
 
 
-def movie_metadata_by_imdb_id(imdb_id):
+def movie_metadata_by_imdb_id(imdb_id, settings=None):
     """Retrieve movie metadata by IMDb ID
 
     Searches for movies based on IMDb ID and retrieves their
@@ -458,6 +822,8 @@ def movie_metadata_by_imdb_id(imdb_id):
 
     Args:
         imdb_id(int): IMDb ID of the movie to be searched
+        settings(SettingsSnapshot): settings holding the API keys,
+            current settings if None
 
     Returns:
         movie(dict): a dictionary containing the movie metadata
@@ -481,9 +847,12 @@ def movie_metadata_by_imdb_id(imdb_id):
         None
     """
     try:
-        movie = omdb_search_by_imdb_id(imdb_id)
+        try:
+            movie = omdb_search_by_imdb_id(imdb_id)
+        except CircuitOpen:
+            movie = None
         if movie is None:
-            movie = tmdb3_search_by_imdb_id(imdb_id)
+            movie = tmdb3_search_by_imdb_id(imdb_id, settings)
         return movie
     except Exception:
         pass
@@ -503,7 +872,7 @@ def _omdb_url():
     return 'http://www.omdbapi.com/?'
 
 
-def omdb_search_by_title(movie_title):
+def omdb_search_by_title(movie_title, year=None):
     """Retrieve movie metadata by title through OMDb
 
     Searches for movies based on their title and retrieves their
@@ -511,6 +880,7 @@ def omdb_search_by_title(movie_title):
 
     Args:
         movie_title(str): title of the movie to be searched
+        year(int): release year of the movie, if known
 
     Returns:
         movie(dict): a dictionary containing the movie metadata
@@ -538,9 +908,11 @@ def omdb_search_by_title(movie_title):
     url = _omdb_url()
     # all spaces in movie title should be replaced with '+' in OMDb
     url = ''.join([url, 's=', movie_title.replace(' ', '+')])
+    if year:
+        url = ''.join([url, '&y=', str(year)])
     log.debug('movie: %s omdb %s' % (movie_title, url))
-    response = urllib2.urlopen(url, timeout=5)
-    data = json.load(response)
+    data = _fetch(
+        'omdb', url[len(_omdb_url()):], lambda: get_json(url), _omdb_found)
     if data.get('Error', None):
         # data = {
         #     "Response":"False",
@@ -605,8 +977,8 @@ def omdb_search_by_imdb_id(imdb_id):
     # option tomatoes for retrieving RottenTomatoes ratings
     url = ''.join([url, 'i=', imdb_id, '&tomatoes=true'])
     log.debug('imdb_id: %s omdb search %s' % (imdb_id, url))
-    response = urllib2.urlopen(url, timeout=5)
-    data = json.load(response)
+    data = _fetch(
+        'omdb', url[len(_omdb_url()):], lambda: get_json(url), _omdb_found)
     if data.get('Error', None):
         # data = {
         #     "Response":"False",
@@ -685,7 +1057,7 @@ def omdb_parse_result(data):
     return movie
 
 
-def tmdb3_search_by_title(movie_title):
+def tmdb3_search_by_title(movie_title, year=None):
     """Retrieve movie metadata by title through TMDb
 
     Searches for movies based on their title and retrieves their
@@ -693,6 +1065,7 @@ def tmdb3_search_by_title(movie_title):
 
     Args:
         movie_title(str): title of the movie to be searched
+        year(int): release year of the movie, if known
 
     Returns:
         movie(dict): a dictionary containing the movie metadata
@@ -717,7 +1090,16 @@ def tmdb3_search_by_title(movie_title):
     try:
         print 'TMDb: ', movie_title
         search = tmdb.Search()
-        response = search.movie(query=movie_title)
+        if year:
+            response = _fetch(
+                'tmdb', 'search=%s&year=%s' % (movie_title, year),
+                lambda: search.movie(query=movie_title, year=year),
+                _tmdb_found)
+        else:
+            response = _fetch(
+                'tmdb', 'search=' + movie_title,
+                lambda: search.movie(query=movie_title), _tmdb_found)
+        results = response['results']
         if response['total_results'] == 0:
             # no match found
             log.warning('movie: %s tmdb no results' % movie_title)
@@ -729,27 +1111,37 @@ def tmdb3_search_by_title(movie_title):
 
         # we have a title, now do an OMDb search by title
         # because TMDb does not support getting imdb ID
-        response = tmdb.Movies(search.results[0]['id'])
-        imdb_id = tmdb.Movies(search.results[0]['id']).info()['imdb_id']
+        tmdb_id = results[0]['id']
+        imdb_id = _fetch(
+            'tmdb', 'movie=%s' % tmdb_id,
+            lambda: tmdb.Movies(tmdb_id).info())['imdb_id']
         log.info('movie: %s %s found by tmdb' % (
-            search.results[0]['title'], imdb_id
+            results[0]['title'], imdb_id
         ))
-        movie = omdb_search_by_imdb_id(imdb_id)
+        try:
+            movie = omdb_search_by_imdb_id(imdb_id)
+        except CircuitOpen:
+            movie = None
         if movie is None:
             # omdb could not get metadata
             # save whatever information we have to database
-            movie = tmdb_parse_result(search.results[0])
-            response = tmdb.Movies(search.results[0]['id'])
-            movie.imdb_id = response.info()['imdb_id']
-            movie.imdb_rating = imdb_rating_by_id(movie.imdb_id)
+            movie = tmdb_parse_result(results[0])
+            movie['imdb_id'] = imdb_id
+            try:
+                movie['imdb_rating'] = imdb_rating_by_id(imdb_id)
+            except CircuitOpen:
+                # keep the movie, without its rating
+                movie['imdb_rating'] = None
         return movie
+    except CircuitOpen as e:
+        log.debug('movie: %s %s unavailable' % (movie_title, e))
     except Exception:
         print movie_title, "TMDb(T): Error retrieving movie metadata!"
         print "TMDb(%s): error occured" % movie_title
         log.error(traceback.format_exc())
 
 
-def tmdb3_search_by_imdb_id(imdb_id):
+def tmdb3_search_by_imdb_id(imdb_id, settings=None):
     """Retrieve movie metadata by IMDb ID through TMDb
 
     Searches for movies based on IMDb ID and retrieves their
@@ -757,6 +1149,8 @@ def tmdb3_search_by_imdb_id(imdb_id):
 
     Args:
         imdb_id(int): IMDb ID of the movie to be searched
+        settings(SettingsSnapshot): settings holding the TMDb key,
+            current settings if None
 
     Returns:
         movie(dict): a dictionary containing the movie metadata
@@ -779,6 +1173,8 @@ def tmdb3_search_by_imdb_id(imdb_id):
     Raises:
         None
     """
+    if settings is None:
+        settings = settings_snapshot()
     try:
         if type(imdb_id) == str or type(imdb_id) == unicode:
             # check for valid format
@@ -802,17 +1198,24 @@ def tmdb3_search_by_imdb_id(imdb_id):
         # log('downloading movie metadata...', newline=False)
         url = 'https://api.themoviedb.org/3/find/%s' \
             '?external_source=imdb_id&api_key=%s' % \
-            (imdb_id, TMDbKey.get_solo().key)
+            (imdb_id, settings.tmdb_key)
         log.debug('%s tmdb by imdb id %s' % (imdb_id, url))
-        res = json.load(urllib2.urlopen(url, timeout=5))
+        res = _fetch(
+            'tmdb', 'find=' + imdb_id, lambda: get_json(url), _tmdb_found)
         if res is not None:
             movie = tmdb_parse_result(res['movie_results'][0])
             movie['imdb_id'] = imdb_id
-            movie['imdb_rating'] = imdb_rating_by_id(imdb_id)
+            try:
+                movie['imdb_rating'] = imdb_rating_by_id(imdb_id)
+            except CircuitOpen:
+                # keep the movie, without its rating
+                movie['imdb_rating'] = None
             return movie
     except KeyError as e:
         print imdb_id, ' TMDb: IMDb ID does not match any known movie.'
         print e
+    except CircuitOpen as e:
+        log.debug('imdb_id: %s %s unavailable' % (imdb_id, e))
     # log('COMPLETE!')
     except Exception:
         print "TMDb(I): %s Error retrieving movie metadata!" % imdb_id
@@ -877,9 +1280,9 @@ def imdb_rating_by_id(imdb_id):
         None
     """
     # log('retrieving IMDb rating...', newline=False)
-    rating = json.load(urllib2.urlopen(
-        'http://app.imdb.com/title/maindetails?tconst=' +
-        str(imdb_id)))['data']['rating']
+    url = 'http://app.imdb.com/title/maindetails?tconst=' + str(imdb_id)
+    rating = _fetch(
+        'imdb', str(imdb_id), lambda: get_json(url))['data']['rating']
     # log(rating)
     return rating
 
@@ -909,13 +1312,13 @@ def tomato_rating_by_imdb_id(imdb_id):
     return rating
 
 
-def start_loader():
+def start_loader(workers=_LOAD_WORKERS):
     """Start the loader
 
     Starts the loader after checking hdd and movie folder are accessible.
 
     Args:
-        None
+        workers(int): number of movies downloaded concurrently
 
     Returns:
         None
@@ -923,16 +1326,15 @@ def start_loader():
     Raises:
         None
     """
-    hdd_root = HDDRoot.get_solo().path
-    if not path.exists(hdd_root):
+    settings = settings_snapshot()
+    if not path.exists(settings.hdd_root):
         print _ERROR[1]
         return _ERROR[1]
-    movie_folder = MovieFolder.get_solo().relpath
-    if not path.exists(path.join(hdd_root, movie_folder)):
+    if not path.exists(settings.movie_folder_path):
         print _ERROR[1]
         return _ERROR[2]
     loader_status('STATUS', True)
-    thread = Thread(target=_run)
+    thread = Thread(target=_run, args=(settings, workers))
     thread.daemon = True
     thread.start()
 
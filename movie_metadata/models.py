@@ -14,6 +14,7 @@ from __future__ import unicode_literals
 from django.utils.encoding import python_2_unicode_compatible
 from django.db import models
 from django.utils.text import slugify
+from solo.models import SingletonModel
 
 
 @python_2_unicode_compatible
@@ -25,13 +26,23 @@ class Movie(models.Model):
     Attributes:
         title(str): movie title
         release(date): release date
-        relpath(str): relative path of the movie file from movie folder
+        year(int): release year parsed from the filename
+        relpath(str): relative path of the movie file from its root,
+            of the first part of a multi-part movie, or of the folder
+            containing a DVD or Blu-ray structure
+        root(str): absolute path of the extra movie folder containing
+            the movie, '' for the movie folder
         actors(Actor, ManyToMany): actors in movie
         directors(Director, ManyToMany): directors in movie
         imdb_score(float): IMDb rating
         tomatoes_rating(int): RottenTomatoes rating
         metascore(int): Metacritic rating
         imdb_id(int): IMDb ID of the movie
+        filehash(str): OpenSubtitles hash of the movie file
+        filesize(int): size of the movie file in bytes
+        inode(int): inode number of the movie file
+        parts(int): number of files of a movie split into parts
+        missing(bool): the movie file was deleted from disk
         slug(str): Slug used for accessing movie in browser
     """
     _id = models.AutoField(primary_key=True)
@@ -39,8 +50,10 @@ class Movie(models.Model):
     # basic information - title, release, poster, relpath
     title = models.CharField(max_length=500,)
     release = models.DateField(blank=True, null=True)
+    year = models.PositiveSmallIntegerField(blank=True, null=True)
     # TODO: poster = models.ImageField(blank=True,)
-    relpath = models.CharField(max_length=500,)
+    relpath = models.CharField(max_length=500, db_index=True,)
+    root = models.CharField(max_length=500, blank=True, db_index=True,)
 
     # cast and crew
     actors = models.ManyToManyField(
@@ -66,6 +79,21 @@ class Movie(models.Model):
         blank=True,
         null=True)
 
+    # movie file, computed by the crawler
+    filehash = models.CharField(
+        max_length=16,
+        blank=True,)
+    filesize = models.BigIntegerField(
+        blank=True,
+        null=True)
+    inode = models.BigIntegerField(
+        blank=True,
+        null=True)
+    parts = models.PositiveSmallIntegerField(
+        default=1,)
+    missing = models.BooleanField(
+        default=False,)
+
     # db stuff
     slug = models.SlugField(
         max_length=500,
@@ -101,10 +129,152 @@ class Movie(models.Model):
         Raises:
             None
         """
-        self.slug = slugify(self.title)
+        self.make_slug()
         # TODO: check if relpath is a valid file
         return super(Movie, self).save(*args, **kwargs)
 
+    def make_slug(self):
+        """Create slug based on movie title
+
+        Also used before saving movies with bulk_create, which does
+        not call save().
+
+        Args:
+            self: current instance of Movie
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.slug = slugify(self.title)
+
+
+@python_2_unicode_compatible
+class DirectorySnapshot(models.Model):
+    """Directory Snapshot
+
+    State of a directory in a movie folder as seen by the last
+    complete crawl. Directories whose modification time and inode are
+    unchanged are not listed again by the next crawl. Directories
+    holding video files which may still be copied are saved with a
+    modification time of 0, so that they are always listed again.
+    The snapshot is only used by crawls with the same video extensions,
+    since files skipped by the crawl which saved it may be movies now.
+
+    Attributes:
+        root(str): root of the movie folder, see Movie
+        relpath(str): relative path of the directory from its root
+        mtime(float): modification time of the directory
+        inode(int): inode number of the directory
+        extensions(str): SHA-1 of the video extensions of the crawl
+    """
+    root = models.CharField(max_length=500, blank=True)
+    relpath = models.CharField(max_length=500)
+    mtime = models.FloatField()
+    inode = models.BigIntegerField()
+    extensions = models.CharField(max_length=40, blank=True)
+
+    class Meta(object):
+        """Meta attributes for DirectorySnapshot
+
+        Attributes:
+            unique_together: a directory is saved once per root
+        """
+        unique_together = ('root', 'relpath')
+
+    def __str__(self):
+        """String representation of DirectorySnapshot
+
+        Args:
+            self: current instance of DirectorySnapshot
+
+        Returns:
+            relpath(str): relative path of the directory
+
+        Raises:
+            None
+        """
+        return self.relpath
+
+
+@python_2_unicode_compatible
+class CrawlCheckpoint(SingletonModel):
+    """Crawl Checkpoint
+
+    Progress of an unfinished crawl, saved periodically so that an
+    interrupted crawl can be resumed instead of starting over.
+
+    Attributes:
+        movie_folder(str): relative path of the crawled movie folder
+        frontier(str): JSON list of [root, relpath] of the directories
+            not yet crawled, relpath from the root
+        files_evaluated(int): number of files listed
+        movies_found(int): number of movie files found
+        movies_added(int): number of movies saved to database
+        updated(datetime): time of the checkpoint
+    """
+    movie_folder = models.CharField(max_length=500, blank=True,)
+    frontier = models.TextField(default='[]',)
+    files_evaluated = models.PositiveIntegerField(default=0,)
+    movies_found = models.PositiveIntegerField(default=0,)
+    movies_added = models.PositiveIntegerField(default=0,)
+    updated = models.DateTimeField(auto_now=True,)
+
+    def __str__(self):
+        """String representation of CrawlCheckpoint
+
+        Args:
+            self: current instance of CrawlCheckpoint
+
+        Returns:
+            str: movie folder and time of the checkpoint
+
+        Raises:
+            None
+        """
+        return '%s at %s' % (self.movie_folder, self.updated)
+
+
+@python_2_unicode_compatible
+class LoadFailure(models.Model):
+    """Load Failure
+
+    A movie the loader could not identify, so that it is not looked up
+    again on every run. The time before the next try doubles with each
+    failure. Movies are keyed by title and file hash, or path when the
+    file was not hashed, so a renamed or replaced file is tried again
+    right away.
+
+    Attributes:
+        key(str): normalized title and OpenSubtitles hash, or hash of
+            the path, of the movie
+        title(str): title of the movie when it last failed
+        failures(int): number of runs in a row which failed
+        retry_after(datetime): time before which it is not tried again
+        updated(datetime): time of the last failure
+    """
+    key = models.CharField(max_length=255, unique=True,)
+    title = models.CharField(max_length=500, blank=True,)
+    failures = models.PositiveIntegerField(default=1,)
+    retry_after = models.DateTimeField()
+    updated = models.DateTimeField(auto_now=True,)
+
+    def __str__(self):
+        """String representation of LoadFailure
+
+        Args:
+            self: current instance of LoadFailure
+
+        Returns:
+            str: title and number of failures
+
+        Raises:
+            None
+        """
+        return '%s (%s failures)' % (self.title, self.failures)
+
 
 @python_2_unicode_compatible
 class Actor(models.Model):
@@ -75,6 +75,20 @@ def save(movie):
     assert movie.get('relpath', None) is not None
     log.debug('%s: relpath %s' % (movie['title'], movie['relpath']))
     movie_in_db.relpath = movie['relpath']
+    movie_in_db.root = movie.get('root', '')
+    # movie file hash and size computed by the crawler
+    if movie.get('filehash', None):
+        movie_in_db.filehash = movie['filehash']
+    if movie.get('filesize', None):
+        movie_in_db.filesize = movie['filesize']
+    if movie.get('inode', None):
+        movie_in_db.inode = movie['inode']
+    movie_in_db.parts = movie.get('parts', None) or 1
+    # release year parsed from the filename, or of the release date
+    if movie.get('year', None):
+        movie_in_db.year = movie['year']
+    elif movie.get('release', None):
+        movie_in_db.year = movie['release'].year
     # imdb rating
     if movie.get('imdb_rating', None):
         log.debug('%s: imdb_rating %s' % (
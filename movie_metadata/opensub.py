@@ -0,0 +1,456 @@
+"""Pool of OpenSubtitles sessions
+
+    The opensub module keeps a few logged in OpenSubtitles clients, so
+    that loader threads can identify movies at the same time. A client
+    is used by a single thread at a time, since it keeps the data of
+    its last response.
+
+    Usage:
+        $ from movie_metadata.opensub import SessionPool
+        $ pool = SessionPool(uid, key)
+        $ data = pool.search_subtitles([{'moviehash': ...}])
+        $ batcher = HashBatcher(pool)
+        $ imdb_id = batcher.lookup(filehash, filesize)
+        $ pool.close()
+
+    Tokens:
+        A client logs in when it is first used. OpenSubtitles expires
+        tokens after 15 minutes without requests, so a client idle for
+        longer than _TOKEN_IDLE logs in again before its next request,
+        and a request refused with 401 is sent again after a new login.
+
+    Batches:
+        A search accepts several hashes, so the hashes looked up by the
+        loader threads are sent together by a HashBatcher. A batch is
+        sent as soon as it holds _BATCH_SIZE hashes, or _BATCH_DELAY
+        seconds after its first hash, and the subtitles found are
+        mapped back to their hashes by MovieHash. Each loader thread
+        waits on a single hash, so a batch is also sent as soon as
+        every loader thread waits on it.
+"""
+
+from threading import Event
+from threading import Lock
+import Queue
+import time
+import logging
+
+from pythonopensubtitles.opensubtitles import OpenSubtitles
+
+log = logging.getLogger('load')
+log.info('opensub module loaded')
+
+_POOL_SIZE = 4
+"""Number of clients, OpenSubtitles allows a few requests at a time
+from the same user
+"""
+
+_TOKEN_IDLE = 10 * 60  # seconds
+"""Time after which an idle client logs in again
+"""
+
+_BATCH_SIZE = 20
+"""Largest number of hashes searched together
+"""
+
+_BATCH_DELAY = 0.5  # seconds
+"""Time a hash waits for others to be searched with
+"""
+
+_RESULT_LIMIT = 500
+"""Largest number of subtitles returned by a search
+"""
+
+
+class LoginFailed(Exception):
+    """OpenSubtitles refused the login
+    """
+
+
+class _Session(object):
+    """OpenSubtitles client with the time of its last request
+    """
+    __slots__ = ('client', 'used')
+
+    def __init__(self):
+        """Create a client which is not logged in
+
+        Args:
+            self: current instance of _Session
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.client = OpenSubtitles()
+        self.used = 0
+
+
+class SessionPool(object):
+    """Session Pool
+
+    Logged in OpenSubtitles clients, created as needed up to size.
+
+    Attributes:
+        uid(str): OpenSubtitles username
+        key(str): OpenSubtitles password
+        size(int): largest number of clients
+    """
+
+    def __init__(self, uid, key, size=_POOL_SIZE, request=None):
+        """Create an empty pool
+
+        Args:
+            self: current instance of SessionPool
+            uid(str): OpenSubtitles username
+            key(str): OpenSubtitles password
+            size(int): largest number of clients
+            request(function): called with a function sending a
+                request, returns its response, such as a rate limiter
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.uid = uid
+        self.key = key
+        self.size = size
+        self._request = request or (lambda send: send())
+        self._idle = Queue.LifoQueue()
+        self._created = 0
+        self._closed = False
+        self._lock = Lock()
+
+    def _acquire(self):
+        """Take an idle client, creating one if the pool is not full
+
+        Args:
+            self: current instance of SessionPool
+
+        Returns:
+            _Session: client for the current thread
+
+        Raises:
+            None
+        """
+        with self._lock:
+            if self._idle.empty() and self._created < self.size:
+                self._created += 1
+                return _Session()
+        return self._idle.get()
+
+    def _login(self, session):
+        """Log a client in
+
+        Args:
+            self: current instance of SessionPool
+            session(_Session): client to log in
+
+        Returns:
+            None
+
+        Raises:
+            LoginFailed: OpenSubtitles refused the login
+        """
+        token = self._request(
+            lambda: session.client.login(self.uid, self.key))
+        if not token:
+            session.client.token = None
+            raise LoginFailed(self.uid)
+        log.debug('opensub session logged in')
+
+    def search_subtitles(self, queries):
+        """Search subtitles on a client of the pool
+
+        Args:
+            self: current instance of SessionPool
+            queries(list): search queries, see
+                OpenSubtitles.search_subtitles
+
+        Returns:
+            list: subtitles found
+            False: if no subtitles were found
+            None: if the search failed
+
+        Raises:
+            LoginFailed: OpenSubtitles refused the login
+            exceptions raised by the request
+        """
+        session = self._acquire()
+        try:
+            if session.client.token is None or \
+                    time.time() - session.used > _TOKEN_IDLE:
+                self._login(session)
+            data = self._request(
+                lambda: session.client.search_subtitles(queries))
+            if data is None and _status(session.client) == '401':
+                log.info('opensub token expired')
+                self._login(session)
+                data = self._request(
+                    lambda: session.client.search_subtitles(queries))
+            session.used = time.time()
+            return data
+        finally:
+            if self._closed:
+                self._logout(session)
+            else:
+                self._idle.put(session)
+
+    def close(self):
+        """Log out the clients of the pool
+
+        Idle clients are logged out at once, and clients in use when
+        their request is done. The pool is not used anymore.
+
+        Args:
+            self: current instance of SessionPool
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self._closed = True
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except Queue.Empty:
+                break
+            self._logout(session)
+
+    def _logout(self, session):
+        """Log a client out, if it is logged in
+
+        Args:
+            self: current instance of SessionPool
+            session(_Session): client to log out
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        if session.client.token is None:
+            return
+        try:
+            self._request(session.client.logout)
+            log.debug('opensub session logged out')
+        except Exception:
+            # the token expires by itself
+            log.warning('opensub session could not log out')
+        session.client.token = None
+
+
+def _status(client):
+    """Status code of the last response of a client
+
+    Args:
+        client(OpenSubtitles): client which sent a request
+
+    Returns:
+        str: status code, such as '200'
+        None: if the client has no response
+
+    Raises:
+        None
+    """
+    data = getattr(client, 'data', None) or {}
+    status = (data.get('status') or '').split()
+    return status[0] if status else None
+
+
+class _Lookup(object):
+    """Hash waiting for the batch it is sent in
+    """
+    __slots__ = ('filehash', 'filesize', 'done', 'sent', 'imdb_id', 'error')
+
+    def __init__(self, filehash, filesize):
+        """Create a lookup which is not sent yet
+
+        Args:
+            self: current instance of _Lookup
+            filehash(str): OpenSubtitles hash of the movie file
+            filesize(int): size of the movie file in bytes
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.filehash = filehash
+        self.filesize = filesize
+        self.done = Event()
+        self.sent = False
+        self.imdb_id = None
+        self.error = None
+
+
+class HashBatcher(object):
+    """Hash Batcher
+
+    Identifies movies by hash in batches: the hashes looked up by
+    threads at about the same time are sent in a single search, see
+    module docstring.
+
+    Attributes:
+        pool(SessionPool): sessions the searches are sent on
+        batch_size(int): largest number of hashes in a search
+        delay(float): seconds a hash waits for others to join its batch
+        threads(int): number of threads looking up hashes, a batch
+            holding as many hashes is full, None if unknown
+    """
+
+    def __init__(self, pool, batch_size=_BATCH_SIZE, delay=_BATCH_DELAY):
+        """Create a batcher with no hashes waiting
+
+        Args:
+            self: current instance of HashBatcher
+            pool(SessionPool): sessions the searches are sent on
+            batch_size(int): largest number of hashes in a search
+            delay(float): seconds a hash waits for others to join
+                its batch
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.pool = pool
+        self.batch_size = batch_size
+        self.delay = delay
+        self.threads = None
+        self._pending = []
+        self._lock = Lock()
+
+    def lookup(self, filehash, filesize):
+        """IMDb ID of a movie file, waiting for its batch to be sent
+
+        The batch is sent by the thread which fills it, or by the
+        first thread whose delay runs out.
+
+        Args:
+            self: current instance of HashBatcher
+            filehash(str): OpenSubtitles hash of the movie file
+            filesize(int): size of the movie file in bytes
+
+        Returns:
+            str: IMDb ID of the movie
+            None: if the hash is not known to OpenSubtitles
+
+        Raises:
+            LoginFailed: OpenSubtitles refused the login
+            exceptions raised by the search of the batch
+        """
+        lookup = _Lookup(filehash.lower(), filesize)
+        with self._lock:
+            self._pending.append(lookup)
+            batch = self._take(full=True)
+        if batch:
+            self._send(batch)
+        if not lookup.done.wait(self.delay):
+            with self._lock:
+                batch = self._take(full=False) if not lookup.sent else None
+            if batch:
+                self._send(batch)
+            lookup.done.wait()
+        if lookup.error is not None:
+            raise lookup.error
+        return lookup.imdb_id
+
+    def _take(self, full):
+        """Take the waiting hashes, with the lock held
+
+        Args:
+            self: current instance of HashBatcher
+            full(bool): only take a full batch
+
+        Returns:
+            list: _Lookup of the batch
+            None: if no batch is taken
+
+        Raises:
+            None
+        """
+        size = min(self.batch_size, self.threads or self.batch_size)
+        if not self._pending or full and len(self._pending) < size:
+            return None
+        batch = self._pending[:size]
+        del self._pending[:size]
+        for lookup in batch:
+            lookup.sent = True
+        return batch
+
+    def _send(self, batch):
+        """Search the hashes of a batch, and wake their threads
+
+        The results of a search are limited to _RESULT_LIMIT
+        subtitles, so hashes missing from a full response are searched
+        again one by one.
+
+        Args:
+            self: current instance of HashBatcher
+            batch(list): _Lookup of the batch
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        try:
+            hashes = {}
+            for lookup in batch:
+                hashes.setdefault(lookup.filehash, lookup.filesize)
+            found = self._search(hashes)
+            log.debug('opensub batch of %s hashes, %s identified' % (
+                len(hashes), len(found)))
+            for lookup in batch:
+                lookup.imdb_id = found.get(lookup.filehash)
+        except Exception as e:
+            for lookup in batch:
+                lookup.error = e
+        finally:
+            for lookup in batch:
+                lookup.done.set()
+
+    def _search(self, hashes):
+        """IMDb IDs of hashes found by OpenSubtitles
+
+        Args:
+            self: current instance of HashBatcher
+            hashes(dict): hash -> file size
+
+        Returns:
+            dict: hash -> IMDb ID of the hashes found
+
+        Raises:
+            LoginFailed: OpenSubtitles refused the login
+            exceptions raised by the search
+        """
+        data = self.pool.search_subtitles([
+            {
+                'sublanguageid': 'all',
+                'moviehash': filehash,
+                'moviebytesize': filesize,
+            }
+            for filehash, filesize in hashes.iteritems()
+        ])
+        found = {}
+        for subtitle in data or ():
+            filehash = (subtitle.get('MovieHash') or '').lower()
+            imdb_id = subtitle.get('IDMovieImdb')
+            if filehash in hashes and imdb_id and filehash not in found:
+                found[filehash] = imdb_id
+        if len(hashes) > 1 and len(data or ()) >= _RESULT_LIMIT:
+            for filehash, filesize in hashes.iteritems():
+                if filehash not in found:
+                    found.update(self._search({filehash: filesize}))
+        return found
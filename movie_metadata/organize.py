@@ -15,6 +15,7 @@ organize movies by:
 from datetime import datetime
 from math import floor
 from ntpath import splitext
+from os import listdir
 from os import makedirs
 from os import path
 from os import walk
@@ -22,8 +23,9 @@ from shutil import move
 from shutil import rmtree
 from threading import Thread
 
-from hdd_settings.models import HDDRoot
-from hdd_settings.models import MovieFolder
+from hdd_settings.models import settings_snapshot
+from movie_metadata.crawl import disc_relpath
+from movie_metadata.crawl import part_number
 from movie_metadata.models import Movie
 
 import logging
@@ -80,6 +82,54 @@ def make_fname(title, relpath):
         return title + extension
 
 
+def _movie_parts(movie, parentpath):
+    """Files of a movie and the names they are moved to
+
+    A DVD or Blu-ray structure is moved as a single folder named after
+    the title, a VIDEO_TS or BDMV folder directly in the movie folder
+    into a folder named after the title. The parts of a multi-part
+    movie keep their part number, so that they are still grouped by the
+    next crawl.
+
+    Args:
+        movie(Movie): movie object from database
+        parentpath(str): absolute path of the movie folder
+
+    Returns:
+        list: (oldpath, fname) of the files or folder of the movie, the
+            first part first, fname relative to the new folder
+
+    Raises:
+        None
+    """
+    oldpath = path.join(parentpath, movie.relpath)
+    if path.isdir(oldpath):
+        if disc_relpath(movie.relpath) == movie.relpath:
+            # structure directly in the movie folder
+            return [(oldpath, path.join(
+                movie.title, path.basename(oldpath)))]
+        return [(oldpath, movie.title)]
+    if movie.parts <= 1:
+        return [(oldpath, make_fname(movie.title, movie.relpath))]
+    dirpath, filename = path.split(oldpath)
+    name, extension = path.splitext(filename)
+    stem = (part_number(name) or (name, ))[0].lower()
+    parts = []
+    for sibling in listdir(dirpath):
+        name, ext = path.splitext(sibling)
+        part = part_number(name)
+        if part is not None and part[0].lower() == stem and \
+                ext.lower() == extension.lower():
+            parts.append((part[1], sibling))
+    if not parts:
+        return [(oldpath, make_fname(movie.title, movie.relpath))]
+    return [
+        (path.join(dirpath, sibling),
+         make_fname('%s.CD%s' % (movie.title, number), sibling))
+        for number, sibling in sorted(parts)
+    ]
+
+
 def _criterion_tools(criterion):
     """select the organization criteria
 
@@ -108,15 +158,19 @@ def _criterion_tools(criterion):
     return _get_folder, _field_exists
 
 
-def _organize(criterion):
+def _organize(criterion, settings=None):
     """organize movies on disk/database by provided criterion
 
-    Selects all movies and updates their filenames based on their
-    metadata titles. Moves their files to organized folders whose
-    name and hierarchy are based on criterion selected.
+    Selects all movies in the movie folder and updates their filenames
+    based on their metadata titles. Movies in extra movie folders, and
+    movies whose files are missing, are left in place. Moves their
+    files to organized folders whose name and hierarchy are based on
+    criterion selected.
 
     Args:
         criterion(str): user choice of organization criterion
+        settings(SettingsSnapshot): settings for this run,
+            current settings if None
 
     Returns:
         None
@@ -149,13 +203,13 @@ def _organize(criterion):
     uncategorized = 'uncategorized'
     log.debug('uncategorized folder set to ./%s/%s' % (
         tempname, uncategorized))
-    parentpath = path.join(
-        HDDRoot.get_solo().path,
-        MovieFolder.get_solo().relpath)
+    if settings is None:
+        settings = settings_snapshot()
+    parentpath = settings.movie_folder_path
     destination = path.join(parentpath, tempname)
     create_folder(destination)
 
-    movies = Movie.objects.all()
+    movies = Movie.objects.filter(root='', missing=False)
     for movie in movies:
 
         # parent folder for the movie file
@@ -166,18 +220,21 @@ def _organize(criterion):
         log.debug('folder: %s' % folder)
         create_folder(folder)
 
-        # create new filename -> title with extension
-        fname = make_fname(movie.title, movie.relpath)
-        # move the file to its new location
-        newpath = path.join(
-            path.join(destination, folder),
-            fname)
-        oldpath = path.join(parentpath, movie.relpath)
-        move(oldpath, newpath)
-        log.debug('%s moved from %s to %s' % (
-            movie.title, movie.relpath, newpath))
-        # update movie path to the newpath
-        movie.relpath = path.join(folder, fname)
+        # create new filenames -> title with extension, and move
+        # every part, or the disc folder, to its new location
+        files = _movie_parts(movie, parentpath)
+        for oldpath, fname in files:
+            create_folder(path.join(folder, path.dirname(fname)))
+            newpath = path.join(
+                path.join(destination, folder),
+                fname)
+            move(oldpath, newpath)
+            log.debug('%s moved from %s to %s' % (
+                movie.title, oldpath, newpath))
+        # update movie path to the newpath of the first part, or of
+        # the folder containing the disc structure
+        movie.relpath = path.join(folder, files[0][1])
+        movie.relpath = disc_relpath(movie.relpath) or movie.relpath
         # save updated movie to database
         movie.save()
 
@@ -297,7 +354,8 @@ def start_organizer(criterion='release'):
         None
     """
     log.info('Started organizer with criterion: %s' % criterion)
-    thread = Thread(target=_organize, args=(criterion, ))
+    thread = Thread(
+        target=_organize, args=(criterion, settings_snapshot()))
     thread.daemon = True
     thread.start()
     log.info('organizer started on daemon thread')
@@ -0,0 +1,272 @@
+"""Probe movie files on hdd
+
+    The probe module reads new movie files found by the crawler. It
+    computes their OpenSubtitles hash, so that the loader does not have
+    to open the file again, and optionally checks their header for the
+    magic bytes of known video containers. This rejects files which
+    only have a video extension, such as .bin, .dat or .pro files,
+    before they are saved and passed to the loader.
+
+    Usage:
+        $ from movie_metadata.probe import Prober
+        $ prober = Prober(sniff=True)
+        $ prober.probe([(filepath, size), ...])
+        $ prober.close()
+
+    Budget:
+        Every crawl has a budget of bytes which can be read for headers.
+        Once it is spent, files are accepted based on their extension.
+        Hashes are not budgeted, since a file hashed by the crawler is
+        not opened again by the loader: the 128KB read for the hash of
+        each file is paced by the read rate of its device instead, see
+        movie_metadata.throttle.
+
+    OpenSubtitles hash:
+        The file size plus the sum of the 64 bit little-endian words
+        of the first and last 64KB of the file.
+"""
+
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+import struct
+import logging
+log = logging.getLogger('crawl')
+log.info('probe module loaded')
+
+_HEADER_SIZE = 4096
+"""Number of bytes read from the start of a file
+"""
+
+_HASH_CHUNK = 65536
+"""Number of bytes hashed from the start and the end of a file
+"""
+
+_SNIFF_BUDGET = 64 * 1024 * 1024  # 64MB
+"""Number of header bytes checked in a single crawl
+"""
+
+_PROBE_WORKERS = 2
+"""Number of threads reading files
+"""
+
+_MP4_BOXES = ('ftyp', 'moov', 'mdat', 'free', 'skip', 'wide', 'pnot')
+"""Top level boxes found at the start of MP4/QuickTime files
+"""
+
+_SIGNATURES = (
+    # Matroska, WebM
+    (0, b'\x1a\x45\xdf\xa3'),
+    # AVI, VCD (.dat)
+    (0, b'RIFF'),
+    # MPEG program stream (.mpg, .vob), MPEG video elementary stream
+    (0, b'\x00\x00\x01\xba'),
+    (0, b'\x00\x00\x01\xb3'),
+    # ASF (.wmv, .asf)
+    (0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11'),
+    # Flash video
+    (0, b'FLV\x01'),
+    # RealMedia
+    (0, b'.RMF'),
+    # Ogg (.ogm, .ogv)
+    (0, b'OggS'),
+    # NUT
+    (0, b'nut/multimedia container'),
+)
+"""Magic bytes of video containers as (offset, bytes)
+"""
+
+
+def is_video(header):
+    """Check a file header for magic bytes of a video container
+
+    Args:
+        header(str): bytes from the start of the file
+
+    Returns:
+        bool: True if the header belongs to a known video container
+
+    Raises:
+        None
+    """
+    for offset, magic in _SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            if magic == b'RIFF':
+                return header[8:12] in (b'AVI ', b'AVIX', b'CDXA')
+            return True
+    # MP4, QuickTime: size of the first box followed by its type
+    if header[4:8] in _MP4_BOXES:
+        return True
+    # MPEG transport stream: sync byte every 188 bytes
+    if header[0:1] == b'\x47' and header[188:189] == b'\x47':
+        return True
+    # BDAV (.m2ts): 4 byte timestamp before each 188 byte packet
+    if header[4:5] == b'\x47' and header[196:197] == b'\x47':
+        return True
+    return False
+
+
+def opensub_hash(f, size, head=None):
+    """OpenSubtitles hash of a file
+
+    Args:
+        f(file): file opened in binary mode
+        size(int): size of the file in bytes
+        head(str): first 64KB of the file if already read
+
+    Returns:
+        str: 16 hex digit hash
+        None: if the file is smaller than 128KB
+
+    Raises:
+        IOError: file could not be read
+    """
+    if size < 2 * _HASH_CHUNK:
+        return None
+    if head is None:
+        f.seek(0)
+        head = f.read(_HASH_CHUNK)
+    f.seek(size - _HASH_CHUNK)
+    tail = f.read(_HASH_CHUNK)
+    if len(head) != _HASH_CHUNK or len(tail) != _HASH_CHUNK:
+        return None
+    filehash = size
+    for chunk in (head, tail):
+        for value in struct.unpack('<%dQ' % (_HASH_CHUNK // 8), chunk):
+            filehash = (filehash + value) & 0xFFFFFFFFFFFFFFFF
+    return '%016x' % filehash
+
+
+class Prober(object):
+    """Prober
+
+    Reads new movie files on a small pool of threads. Header checks
+    share a byte budget across all files of a crawl.
+
+    Attributes:
+        sniff(bool): check file headers for video containers
+        remaining(int): header bytes which can still be checked, None
+            for no budget
+        rejected(int): number of files rejected
+    """
+
+    def __init__(
+            self,
+            sniff=False,
+            budget=_SNIFF_BUDGET,
+            workers=_PROBE_WORKERS):
+        """Create a prober
+
+        Args:
+            self: current instance of Prober
+            sniff(bool): check file headers for video containers
+            budget(int): number of header bytes which can be checked,
+                None for no budget
+            workers(int): number of threads reading files
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.sniff = sniff
+        self.remaining = budget
+        self.rejected = 0
+        self._lock = Lock()
+        self._pool = ThreadPool(workers)
+
+    def probe(self, files, throttle=None):
+        """Probe movie files
+
+        Args:
+            self: current instance of Prober
+            files(list): (filepath, size) tuples
+                filepath(str): absolute path of file
+                size(int): size of file in bytes
+            throttle(DeviceThrottle): limits on reads from the device
+                of the files, no limits if None
+
+        Returns:
+            list: (video, filehash) tuple for each file
+                video(bool): False if the file is rejected
+                filehash(str): OpenSubtitles hash, None if unavailable
+
+        Raises:
+            None
+        """
+        if not files:
+            return []
+        results = self._pool.map(self._probe, [
+            (filepath, size, throttle) for filepath, size in files])
+        self.rejected += [video for video, filehash in results].count(False)
+        return results
+
+    def close(self):
+        """Stop the threads reading files
+
+        Args:
+            self: current instance of Prober
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self._pool.close()
+        self._pool.join()
+        log.info('prober rejected %s files, %s bytes of budget left' % (
+            self.rejected, self.remaining))
+
+    def _probe(self, file_info):
+        """Read a file, check its header and hash it
+
+        Files are accepted without checking their header when the
+        budget is spent, or when the file cannot be read.
+
+        Args:
+            self: current instance of Prober
+            file_info(tuple): (filepath, size, throttle), see probe
+
+        Returns:
+            tuple(video, filehash): see probe
+
+        Raises:
+            None
+        """
+        filepath, size, throttle = file_info
+        if throttle is not None:
+            # head and tail of the file for its hash
+            throttle.reads.take(2 * _HASH_CHUNK)
+        try:
+            with open(filepath, 'rb') as f:
+                head = f.read(_HASH_CHUNK)
+                if self.sniff and self._spend(_HEADER_SIZE) and \
+                        not is_video(head[:_HEADER_SIZE]):
+                    log.info('%s rejected, not a video' % filepath)
+                    return False, None
+                return True, opensub_hash(f, size, head)
+        except IOError:
+            log.warning('%s could not be read' % filepath)
+            return True, None
+
+    def _spend(self, size):
+        """Take bytes from the header budget
+
+        Args:
+            self: current instance of Prober
+            size(int): number of bytes
+
+        Returns:
+            bool: True if the budget allows reading the bytes
+
+        Raises:
+            None
+        """
+        if self.remaining is None:
+            return True
+        with self._lock:
+            if self.remaining < size:
+                return False
+            self.remaining -= size
+            return True
@@ -0,0 +1,178 @@
+"""Parse scene release filenames
+
+    The release module splits a movie filename into its title and the
+    tags of scene and torrent releases, such as
+        The.Dark.Knight.2008.1080p.BluRay.x264-GROUP
+    in a single pass over its tokens.
+
+    Usage:
+        $ from movie_metadata.release import parse_release
+        $ release = parse_release('The.Dark.Knight.2008.1080p.BluRay')
+        $ release.title, release.year
+        ('The Dark Knight', 2008)
+
+    Title:
+        The title is made of the tokens before the release year, or
+        before the first tag when there is no year. Titles starting with
+        or containing a year (2012, Blade Runner 2049) are kept, since
+        the last year before the tags is the release year, and a year
+        alone is a title. Titles containing a word which is also a tag
+        (Charlotte's Web 2006) are kept when a year follows them, unless
+        a resolution or codec comes before the year.
+"""
+
+from collections import namedtuple
+import re
+
+_GROUP_PREFIX = re.compile(r"^\s*\[[^\]]*\]\s*")
+"""Release group or site name in brackets at the start of a filename
+"""
+
+_SEPARATORS = re.compile(r"[\s._\[\]\(\)\{\}]+")
+"""Characters separating tokens, dashes are kept within tokens
+"""
+
+_YEAR = re.compile(r"^(19|20)\d\d$")
+"""Release year
+"""
+
+_RESOLUTION = re.compile(r"^(\d{3,4})[pi]$", re.IGNORECASE)
+"""Vertical resolution, such as 720p or 1080i
+"""
+
+_RESOLUTIONS = {
+    '4k': '2160p',
+    'uhd': '2160p',
+}
+"""Resolution tags without a number of lines
+"""
+
+_SOURCES = {
+    'bluray': 'BluRay',
+    'blu-ray': 'BluRay',
+    'bdrip': 'BluRay',
+    'brrip': 'BluRay',
+    'bdremux': 'BluRay',
+    'remux': 'BluRay',
+    'web-dl': 'WEB-DL',
+    'webdl': 'WEB-DL',
+    'web': 'WEB-DL',
+    'webrip': 'WEBRip',
+    'hdrip': 'HDRip',
+    'hdtv': 'HDTV',
+    'dvdrip': 'DVDRip',
+    'dvd': 'DVD',
+    'dvdr': 'DVD',
+    'dvd5': 'DVD',
+    'dvd9': 'DVD',
+    'dvdscr': 'Screener',
+    'screener': 'Screener',
+    'scr': 'Screener',
+    'r5': 'R5',
+    'cam': 'CAM',
+    'camrip': 'CAM',
+    'hdcam': 'CAM',
+    'ts': 'Telesync',
+    'telesync': 'Telesync',
+    'hdts': 'Telesync',
+}
+"""Lowercase source tags -> source
+"""
+
+_CODECS = {
+    'x264': 'x264',
+    'h264': 'x264',
+    'avc': 'x264',
+    'x265': 'x265',
+    'h265': 'x265',
+    'hevc': 'x265',
+    'xvid': 'XviD',
+    'divx': 'DivX',
+    'vp9': 'VP9',
+    'av1': 'AV1',
+}
+"""Lowercase codec tags -> codec
+"""
+
+_OTHER_TAGS = frozenset((
+    '3d', '10bit', '8bit', 'aac', 'ac3', 'atmos', 'dd5', 'dts', 'dual',
+    'extended', 'hdr', 'internal', 'limited', 'multi', 'proper',
+    'readnfo', 'repack', 'subbed', 'truehd', 'unrated', 'uncut',
+))
+"""Lowercase tags which end the title but are not kept
+"""
+
+ReleaseInfo = namedtuple(
+    str('ReleaseInfo'),
+    ('title', 'year', 'resolution', 'source', 'codec'))
+"""Parts of a release filename, tags are None when missing
+"""
+
+
+def parse_release(filename):
+    """Parse a release filename
+
+    Args:
+        filename(str): filename without extension
+
+    Returns:
+        ReleaseInfo: title, year(int), resolution(str), source(str)
+            and codec(str) of the release
+
+    Raises:
+        None
+    """
+    tokens = [
+        token for token in
+        _SEPARATORS.split(_GROUP_PREFIX.sub('', filename))
+        if token
+    ]
+    # index of the first tag, of the first resolution or codec,
+    # and of the release year
+    end = None
+    strong_end = None
+    year_at = None
+    year = resolution = source = codec = None
+    source_at = None
+    # the first token always belongs to the title
+    for i, token in enumerate(tokens[1:], 1):
+        if _YEAR.match(token):
+            if strong_end is None and (end is None or year_at is None):
+                year_at = i
+            continue
+        tags = (token, )
+        if '-' in token:
+            # a release group follows the last tag after a dash
+            tags = (token, token.split('-', 1)[0])
+        for tag in tags:
+            lower = tag.lower()
+            # resolution and codec are never words of a title
+            strong = True
+            if lower in _RESOLUTIONS or \
+                    lower[:1].isdigit() and _RESOLUTION.match(tag):
+                resolution = resolution or _RESOLUTIONS.get(lower, lower)
+            elif lower in _CODECS:
+                codec = codec or _CODECS[lower]
+            elif lower in _SOURCES:
+                if source is None or source_at < year_at:
+                    source, source_at = _SOURCES[lower], i
+                strong = False
+            elif lower in _OTHER_TAGS:
+                strong = False
+            else:
+                continue
+            if end is None:
+                end = i
+            if strong and strong_end is None:
+                strong_end = i
+            break
+    if year_at is not None:
+        year = int(tokens[year_at])
+        end = year_at
+        if source_at < year_at:
+            # a word of the title
+            source = None
+    title = ' '.join(tokens[:end]).strip(' -')
+    if not title:
+        title = ' '.join(filename.split('.')).strip()
+    return ReleaseInfo(title, year, resolution, source, codec)
@@ -0,0 +1,336 @@
+"""Throttle disk operations of the crawler
+
+    The throttle module limits how hard the crawler works a disk, so
+    that crawls can run alongside the loader and movie playback. Each
+    device gets its own limits:
+        - a token bucket for stat operations
+        - a token bucket for bytes read from movie files
+        - an adaptive limit on the number of threads listing directories
+
+    Usage:
+        $ from movie_metadata.throttle import Throttles
+        $ throttles = Throttles(settings)
+        $ throttle = throttles.for_root(root)
+        $ throttle.stats.take()
+        $ with throttle.limit:
+        $     ...
+
+    Adaptive limit:
+        The number of threads allowed to list directories on a device is
+        increased by one after as many fast stat operations as threads,
+        and halved when a stat takes longer than the target latency
+        (additive increase, multiplicative decrease). It is halved at
+        most once every _DECREASE_INTERVAL seconds, since the threads
+        which are already running see the same slow disk.
+"""
+
+from os import stat
+from threading import Condition
+from threading import Lock
+import time
+import logging
+log = logging.getLogger('crawl')
+log.info('throttle module loaded')
+
+_DECREASE_INTERVAL = 1  # seconds
+"""Minimum time between two decreases of an adaptive limit
+"""
+
+
+class TokenBucket(object):
+    """Token Bucket
+
+    Hands out tokens at a steady rate, allowing bursts of up to one
+    second worth of tokens. Callers taking more tokens than available
+    wait until the tokens have been refilled.
+
+    Attributes:
+        rate(float): tokens per second, 0 for no limit
+        capacity(float): maximum number of tokens stored
+    """
+
+    def __init__(self, rate, capacity=None):
+        """Create a full token bucket
+
+        Args:
+            self: current instance of TokenBucket
+            rate(float): tokens per second, 0 for no limit
+            capacity(float): maximum number of tokens stored,
+                rate if None
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = Lock()
+
+    def take(self, tokens=1):
+        """Take tokens, waiting until they are available
+
+        Tokens are reserved before waiting, so that callers are served
+        in order and a request larger than the capacity still passes.
+
+        Args:
+            self: current instance of TokenBucket
+            tokens(float): number of tokens
+
+        Returns:
+            float: seconds waited
+
+        Raises:
+            None
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class AdaptiveLimit(object):
+    """Adaptive Limit
+
+    Limits the number of threads doing work at the same time, adapting
+    the limit to the observed latency, see module docstring. Used as a
+    context manager around the work of a thread.
+
+    Attributes:
+        limit(int): number of threads currently allowed
+        maximum(int): largest limit
+        target(float): latency in seconds above which the limit is
+            decreased, 0 to never decrease it
+    """
+
+    def __init__(self, maximum, target):
+        """Create a limit allowing the maximum number of threads
+
+        Args:
+            self: current instance of AdaptiveLimit
+            maximum(int): largest limit
+            target(float): target latency in seconds
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.limit = maximum
+        self.maximum = maximum
+        self.target = target
+        self._active = 0
+        self._fast = 0
+        self._decreased = 0
+        self._condition = Condition(Lock())
+
+    def __enter__(self):
+        """Wait until the limit allows another thread
+
+        Args:
+            self: current instance of AdaptiveLimit
+
+        Returns:
+            AdaptiveLimit: self
+
+        Raises:
+            None
+        """
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        """Let another thread in
+
+        Args:
+            self: current instance of AdaptiveLimit
+            *exc_info: exception raised by the work, if any
+
+        Returns:
+            bool: False, exceptions are not suppressed
+
+        Raises:
+            None
+        """
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+        return False
+
+    def observe(self, latency):
+        """Adapt the limit to the latency of an operation
+
+        Args:
+            self: current instance of AdaptiveLimit
+            latency(float): seconds taken by the operation
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        if not self.target:
+            return
+        with self._condition:
+            if latency > self.target:
+                self._fast = 0
+                now = time.time()
+                if self.limit > 1 and \
+                        now - self._decreased >= _DECREASE_INTERVAL:
+                    self._decreased = now
+                    self.limit = max(1, self.limit // 2)
+                    log.info('stat took %.3fs, crawler threads -> %s' % (
+                        latency, self.limit))
+                return
+            self._fast += 1
+            if self._fast >= self.limit and self.limit < self.maximum:
+                self._fast = 0
+                self.limit += 1
+                self._condition.notify()
+
+
+class DeviceThrottle(object):
+    """Device Throttle
+
+    Limits on the crawler operations for a single device.
+
+    Attributes:
+        stats(TokenBucket): tokens for stat operations
+        reads(TokenBucket): tokens for bytes read
+        limit(AdaptiveLimit): threads listing directories
+    """
+
+    def __init__(self, settings):
+        """Create the limits of a device
+
+        Args:
+            self: current instance of DeviceThrottle
+            settings(SettingsSnapshot): settings for this crawl
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.stats = TokenBucket(settings.stat_rate)
+        self.reads = TokenBucket(settings.read_rate)
+        self.limit = AdaptiveLimit(
+            settings.crawl_workers, settings.stat_latency)
+
+    def stat(self, filepath):
+        """Stat a file within the limits of the device
+
+        Args:
+            self: current instance of DeviceThrottle
+            filepath(str): absolute path of the file
+
+        Returns:
+            stat_result: see os.stat
+
+        Raises:
+            OSError: file could not be read
+        """
+        return self._timed(stat, filepath)
+
+    def entry_stat(self, entry):
+        """Stat a directory entry within the limits of the device
+
+        Uses the stat result cached on the entry by scandir, if any.
+
+        Args:
+            self: current instance of DeviceThrottle
+            entry(DirEntry): entry of a directory listing
+
+        Returns:
+            stat_result: see DirEntry.stat
+
+        Raises:
+            OSError: file could not be read
+        """
+        return self._timed(entry.stat)
+
+    def _timed(self, function, *args):
+        """Take a stat token, and time a stat operation
+
+        Args:
+            self: current instance of DeviceThrottle
+            function(function): stat operation
+            *args: arguments of the operation
+
+        Returns:
+            stat_result: result of the operation
+
+        Raises:
+            OSError: file could not be read
+        """
+        self.stats.take()
+        started = time.time()
+        try:
+            return function(*args)
+        finally:
+            self.limit.observe(time.time() - started)
+
+
+class Throttles(object):
+    """Throttles
+
+    Device throttles for the movie folders of a crawl. Folders on the
+    same device share a single throttle.
+    """
+
+    def __init__(self, settings):
+        """Create the throttles of the movie folders
+
+        Args:
+            self: current instance of Throttles
+            settings(SettingsSnapshot): settings for this crawl
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        devices = {}
+        self._roots = {}
+        for root, folder in settings.movie_folders.iteritems():
+            try:
+                device = stat(folder).st_dev
+            except OSError:
+                device = None
+            if device not in devices:
+                devices[device] = DeviceThrottle(settings)
+            self._roots[root] = devices[device]
+
+    def for_root(self, root):
+        """Throttle of the device of a movie folder
+
+        Args:
+            self: current instance of Throttles
+            root(str): root of the movie folder
+
+        Returns:
+            DeviceThrottle: throttle of its device
+
+        Raises:
+            KeyError: root is not a movie folder of the crawl
+        """
+        return self._roots[root]
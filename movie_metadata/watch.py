@@ -0,0 +1,788 @@
+"""Watch movie folders for changes
+
+    The watch module keeps the database in step with the movie folders
+    without crawling them again. Changes are handled as they happen:
+        - new movie files are added, the same way the crawler adds them
+        - renamed or moved movie files get their relpath updated, also
+          when they are only seen as a new file, see crawl.match_moved
+        - deleted movie files are flagged as missing
+
+    Usage:
+        $ from movie_metadata import watch
+        $ watch.start_watcher()
+        $ watch.stop_watcher()
+
+    inotify:
+        When pyinotify is installed (Linux only), the watcher sleeps
+        until the kernel reports a change in one of the movie folders.
+        If a directory cannot be watched, such as when the inotify
+        watch limit is reached, the watcher polls instead.
+
+    Polling:
+        Without pyinotify, the movie folders are walked every
+        _POLL_INTERVAL seconds. Only directories whose modification
+        time changed are listed again, and their movie files are
+        compared with the previous listing. New files are added once
+        their size is the same in two listings, so that files still
+        being copied are not hashed.
+
+    The watcher only sees changes made while it is running, a crawl
+    brings the database up to date before starting it.
+"""
+
+from os import listdir
+from os import path
+from os import stat
+from os import walk
+import threading
+import time
+import logging
+import traceback
+log = logging.getLogger('crawl')
+log.info('watch module loaded')
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+    log.info('pyinotify not available, watcher will poll')
+
+from django.db import transaction
+from django.db.models import Q
+
+from hdd_settings.models import settings_snapshot
+from movie_metadata import crawl
+from movie_metadata.models import Movie
+from movie_metadata.probe import Prober
+from movie_metadata.throttle import Throttles
+
+_POLL_INTERVAL = 60  # seconds
+"""Time between two walks of the movie folders when polling
+"""
+
+_EVENT_TIMEOUT = 1000  # milliseconds
+"""Time inotify waits for events before checking the watcher status
+"""
+
+_SETTLE_INTERVAL = 5  # seconds
+"""Time between two checks of the files found in new directories, a
+file is added once its size is the same in two checks
+"""
+
+_ERROR = {
+    1: 'HDD Root not configured properly.',
+    2: 'Movie Folder not configured properly.',
+    3: 'Watcher is already running.',
+}
+"""Watcher Error messages
+"""
+
+
+def watcher_status(key=None, value=None):
+    """Watcher status
+
+    Args:
+        key(dict key): key to search in dict
+        value(dict value): value to assign to key
+
+    Returns:
+        bool: True for ON, False for OFF
+    """
+    if 'status' not in watcher_status.__dict__:
+        watcher_status.status = {
+            'STATUS': False,
+            'MODE': '',
+            'EVENTS': 0,
+        }
+    _WATCHER = watcher_status.status
+    if _WATCHER.get(key) is not None:
+        if value is not None:
+            if key != 'EVENTS':
+                log.info('watcher status: %s -> %s' % (key, value))
+            _WATCHER[key] = value
+        else:
+            return _WATCHER[key]
+    return _WATCHER['STATUS']
+
+
+def start_watcher():
+    """Start the watcher
+
+    Starts watching the movie folder and the extra movie folders after
+    checking they are accessible.
+
+    Args:
+        None
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    log.info('start watcher')
+    if watcher_status():
+        return _ERROR[3]
+    settings = settings_snapshot()
+    if not path.exists(settings.hdd_root):
+        log.error('%s is not a valid hdd root path' % settings.hdd_root)
+        return _ERROR[1]
+    if not path.exists(settings.movie_folder_path):
+        log.error('%s is not a valid movie folder path' % (
+            settings.movie_folder))
+        return _ERROR[2]
+    extra_folders = tuple(
+        folder for folder in settings.extra_folders if path.isdir(folder))
+    for folder in set(settings.extra_folders) - set(extra_folders):
+        log.warning('%s is not a valid folder, not watched' % folder)
+    settings = settings._replace(extra_folders=extra_folders)
+    watcher_status('STATUS', True)
+    watcher_status('EVENTS', 0)
+    thread = threading.Thread(
+        target=watch_movies,
+        kwargs={'settings': settings},
+    )
+    thread.daemon = True
+    thread.start()
+    log.info('watcher started on daemon thread')
+
+
+def stop_watcher():
+    """Stop the watcher
+
+    Args:
+        None
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    log.info('watcher stopped')
+    watcher_status('STATUS', False)
+
+
+def watch_movies(settings=None, poll_interval=_POLL_INTERVAL):
+    """Watch movie folders until the watcher is stopped
+
+    Uses inotify when pyinotify is available and every directory can
+    be watched, polling otherwise.
+
+    Args:
+        settings(SettingsSnapshot): settings for this run,
+            current settings if None
+        poll_interval(int): seconds between two walks when polling
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    if settings is None:
+        settings = settings_snapshot()
+    events = MovieEvents(settings)
+    try:
+        watched = False
+        if pyinotify is not None:
+            watcher_status('MODE', 'inotify')
+            watched = _notify(settings, events)
+        if not watched and watcher_status():
+            watcher_status('MODE', 'polling')
+            _poll(settings, events, poll_interval)
+    except Exception:
+        log.error('watcher failed')
+        log.error(traceback.format_exc())
+    finally:
+        events.close()
+        watcher_status('STATUS', False)
+
+
+class MovieEvents(object):
+    """Movie Events
+
+    Applies changes of movie files to the database. Files are checked
+    against the video extensions and the size threshold of the crawler,
+    and new movies are probed and saved the same way as during a crawl.
+
+    Attributes:
+        settings(SettingsSnapshot): settings for this run
+        extensions(frozenset): lowercase video file extensions
+    """
+
+    def __init__(self, settings):
+        """Create the event handler for a run of the watcher
+
+        Args:
+            self: current instance of MovieEvents
+            settings(SettingsSnapshot): settings for this run
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.settings = settings
+        self.extensions = crawl.video_extensions()
+        # the watcher reads files as they come, not in a crawl
+        self._prober = Prober(budget=None)
+        # absolute file path -> size at the last check, None if not
+        # checked yet, of files in new directories
+        self._unsettled = {}
+
+    def close(self):
+        """Stop the threads reading files
+
+        Args:
+            self: current instance of MovieEvents
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self._prober.close()
+
+    def created(self, filepath, is_dir=False):
+        """A file or directory was created, or moved into a folder
+
+        Args:
+            self: current instance of MovieEvents
+            filepath(str): absolute path of the file or directory
+            is_dir(bool): True for a directory, whose files are added
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        if is_dir:
+            for dirpath, dirnames, filenames in walk(filepath):
+                for filename in filenames:
+                    self.created(path.join(dirpath, filename))
+            return
+        self._unsettled.pop(filepath, None)
+        if path.splitext(filepath)[1].lower() not in self.extensions:
+            return
+        location = self._locate(filepath)
+        if location is None:
+            return
+        root, relpath = location
+        name = path.splitext(path.basename(filepath))[0]
+        parts = [filepath]
+        if crawl.part_number(name) is not None:
+            parts = self._parts(filepath)
+            relpaths = [
+                path.join(path.dirname(relpath), path.basename(part))
+                for part in parts]
+            if parts[0] != filepath:
+                # multi-part movies are saved for their first part
+                Movie.objects.filter(
+                    root=root, relpath=relpaths[0],
+                ).update(parts=len(parts))
+                return
+            if len(parts) > 1:
+                name = crawl.part_number(name)[0]
+                # later parts seen before the first one were saved alone
+                Movie.objects.filter(
+                    root=root, relpath__in=relpaths[1:], missing=False,
+                ).update(missing=True)
+        disc = crawl.disc_relpath(relpath)
+        if disc is not None:
+            # DVD and Blu-ray structures are saved for their folder,
+            # with the file of their largest stream, as by the crawler
+            filepath = self._largest_stream(
+                self.settings.movie_path(disc, root))
+            if filepath is None:
+                return
+            relpath, name = disc, crawl.disc_name(
+                disc, self.settings.movie_folders[root])
+        try:
+            filestat = stat(filepath)
+        except OSError:
+            log.warning('%s could not be read' % filepath)
+            return
+        size, inode = filestat.st_size, filestat.st_ino
+        if size < crawl.MOVIE_SIZE_THRESHOLD:
+            return
+        movies = Movie.objects.filter(root=root, relpath=relpath)
+        if movies.exists():
+            if disc is not None and \
+                    movies.filter(filesize=size, inode=inode).exists():
+                # the largest stream of a known disc is unchanged
+                movies.update(missing=False)
+                return
+            # file deleted and created again, or written over, or a
+            # larger stream of a disc
+            video, filehash = self._prober.probe([(filepath, size)])[0]
+            if video:
+                movies.update(
+                    missing=False,
+                    parts=len(parts),
+                    filesize=size,
+                    inode=inode,
+                    filehash=filehash or '')
+            return
+        candidates = list(Movie.objects.filter(filesize=size).values_list(
+            'pk', 'root', 'relpath', 'inode', 'filehash'))
+        moved = crawl.match_moved(self.settings, candidates, inode=inode)
+        if moved is None:
+            video, filehash = self._prober.probe([(filepath, size)])[0]
+            if not video:
+                return
+            moved = crawl.match_moved(
+                self.settings, candidates, filehash=filehash)
+        if moved is not None:
+            crawl.move_movie(moved, root, relpath, inode)
+            self._count()
+            return
+        release = crawl.parse_filename(name)
+        movie = Movie()
+        movie.title = release.title
+        movie.year = release.year
+        movie.relpath = relpath
+        movie.root = root
+        movie.filesize = size
+        movie.inode = inode
+        movie.parts = len(parts)
+        movie.filehash = filehash or ''
+        crawl.save_movies([movie])
+        self._count()
+
+    def created_later(self, dirpath):
+        """A directory was created, its files may still be written
+
+        The movie files found in the directory are added by settle
+        once their size stops changing, or when they are closed after
+        writing, whichever comes first.
+
+        Args:
+            self: current instance of MovieEvents
+            dirpath(str): absolute path of the directory
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        for dirpath, dirnames, filenames in walk(dirpath):
+            for filename in filenames:
+                if path.splitext(filename)[1].lower() in self.extensions:
+                    self._unsettled[path.join(dirpath, filename)] = None
+
+    def settle(self):
+        """Add the files of new directories whose size stopped changing
+
+        Args:
+            self: current instance of MovieEvents
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        for filepath, size in self._unsettled.items():
+            try:
+                current = stat(filepath).st_size
+            except OSError:
+                # deleted or moved away before it settled
+                del self._unsettled[filepath]
+                continue
+            if current == size:
+                self.created(filepath)
+            else:
+                self._unsettled[filepath] = current
+
+    def _largest_stream(self, dirpath):
+        """Largest movie file of a DVD or Blu-ray structure
+
+        Args:
+            self: current instance of MovieEvents
+            dirpath(str): absolute path of the disc folder
+
+        Returns:
+            str: absolute path of the largest file with a video
+                extension, the main title of the disc
+            None: if the disc holds no such file
+
+        Raises:
+            None
+        """
+        largest = None
+        for dirpath, dirnames, filenames in walk(dirpath):
+            for filename in filenames:
+                if path.splitext(filename)[1].lower() not in \
+                        self.extensions:
+                    continue
+                filepath = path.join(dirpath, filename)
+                try:
+                    size = stat(filepath).st_size
+                except OSError:
+                    continue
+                if largest is None or size > largest[0]:
+                    largest = (size, filepath)
+        return largest[1] if largest else None
+
+    def _parts(self, filepath):
+        """Parts of a multi-part movie
+
+        The parts are the movie files of the directory whose names only
+        differ by the part tag, as grouped by the crawler. A file with
+        a part tag and no other parts is a movie of its own, such as
+        the second movie of a series.
+
+        Args:
+            self: current instance of MovieEvents
+            filepath(str): absolute path of a file with a part tag
+
+        Returns:
+            list: absolute paths of the parts, first part first
+
+        Raises:
+            None
+        """
+        dirpath, filename = path.split(filepath)
+        name, extension = path.splitext(filename)
+        stem = crawl.part_number(name)[0].lower()
+        try:
+            filenames = listdir(dirpath)
+        except OSError:
+            return [filepath]
+        parts = []
+        for sibling in filenames:
+            name, ext = path.splitext(sibling)
+            part = crawl.part_number(name)
+            if part is None or part[0].lower() != stem or \
+                    ext.lower() != extension.lower():
+                continue
+            try:
+                size = stat(path.join(dirpath, sibling)).st_size
+            except OSError:
+                continue
+            if size >= crawl.MOVIE_SIZE_THRESHOLD:
+                parts.append((part[1], sibling))
+        if len(parts) < 2:
+            return [filepath]
+        return [
+            path.join(dirpath, sibling) for number, sibling in sorted(parts)]
+
+    def deleted(self, filepath, is_dir=False):
+        """A file or directory was deleted, or moved out of a folder
+
+        Args:
+            self: current instance of MovieEvents
+            filepath(str): absolute path of the file or directory
+            is_dir(bool): True for a directory, whose movies are flagged
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        location = self._locate(filepath)
+        if location is None:
+            return
+        root, relpath = location
+        disc = crawl.disc_relpath(relpath)
+        if disc is not None and disc != relpath:
+            # DVD and Blu-ray structures are saved for their folder,
+            # which is missing once none of its streams are left
+            if self._has_streams(self.settings.movie_path(disc, root)):
+                return
+            relpath, is_dir = disc, False
+        movies = Movie.objects.filter(root=root, missing=False)
+        if is_dir:
+            # movies in the directory, or a disc structure it contains
+            movies = movies.filter(
+                Q(relpath=relpath) |
+                Q(relpath__startswith=relpath + path.sep))
+        else:
+            movies = movies.filter(relpath=relpath)
+        flagged = movies.update(missing=True)
+        if flagged:
+            log.info('%s movies missing from %s' % (flagged, filepath))
+            self._count()
+
+    def _has_streams(self, dirpath):
+        """Check whether a directory still holds movie files
+
+        Args:
+            self: current instance of MovieEvents
+            dirpath(str): absolute path of the directory
+
+        Returns:
+            bool: True if a file with a video extension is left
+
+        Raises:
+            None
+        """
+        for dirpath, dirnames, filenames in walk(dirpath):
+            for filename in filenames:
+                if path.splitext(filename)[1].lower() in self.extensions:
+                    return True
+        return False
+
+    def moved(self, src_path, dest_path, is_dir=False):
+        """A file or directory was renamed or moved
+
+        Args:
+            self: current instance of MovieEvents
+            src_path(str): absolute path before the move
+            dest_path(str): absolute path after the move
+            is_dir(bool): True for a directory
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        src = self._locate(src_path)
+        dest = self._locate(dest_path)
+        if src is None:
+            self.created(dest_path, is_dir)
+            return
+        if dest is None:
+            self.deleted(src_path, is_dir)
+            return
+        (src_root, src_relpath), (dest_root, dest_relpath) = src, dest
+        if not is_dir:
+            updated = Movie.objects.filter(
+                root=src_root, relpath=src_relpath,
+            ).update(root=dest_root, relpath=dest_relpath, missing=False)
+            if updated:
+                log.info('%s moved to %s' % (src_path, dest_path))
+                self._count()
+            else:
+                self.created(dest_path)
+            return
+        prefix = src_relpath + path.sep
+        with transaction.atomic():
+            movies = Movie.objects.filter(
+                Q(relpath=src_relpath) | Q(relpath__startswith=prefix),
+                root=src_root)
+            for movie in movies:
+                movie.root = dest_root
+                if movie.relpath == src_relpath:
+                    # the directory holds a disc structure
+                    movie.relpath = dest_relpath
+                else:
+                    movie.relpath = path.join(
+                        dest_relpath, movie.relpath[len(prefix):])
+                movie.missing = False
+                movie.save()
+        log.info('%s moved to %s' % (src_path, dest_path))
+        self._count()
+
+    def _locate(self, filepath):
+        """Root and relative path of a file in the movie folders
+
+        Args:
+            self: current instance of MovieEvents
+            filepath(str): absolute path of the file
+
+        Returns:
+            tuple(root, relpath): relpath from the folder of root
+            None: if the file is not in any movie folder
+
+        Raises:
+            None
+        """
+        filepath = path.normpath(filepath)
+        # the deepest folder wins if folders are nested
+        for root, folder in sorted(
+                self.settings.movie_folders.iteritems(),
+                key=lambda item: len(item[1]),
+                reverse=True):
+            folder = path.normpath(folder)
+            if filepath.startswith(folder + path.sep):
+                return root, path.relpath(filepath, folder)
+        return None
+
+    def _count(self):
+        """Count an event applied to the database
+
+        Args:
+            self: current instance of MovieEvents
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        watcher_status('EVENTS', watcher_status('EVENTS') + 1)
+
+
+def _notify(settings, events):
+    """Watch movie folders with inotify until the watcher is stopped
+
+    Files are added once they are closed after writing, so that files
+    being copied are not hashed. Files already in a new directory when
+    it is first watched are added once their size stops changing, see
+    MovieEvents.settle. A move out of a movie folder is seen
+    as a delete, and a move within the movie folders restores the
+    movies it flagged.
+
+    Stops when a directory cannot be watched, such as when the inotify
+    watch limit is reached, so that the watcher polls instead.
+
+    Args:
+        settings(SettingsSnapshot): settings for this run
+        events(MovieEvents): applies events to the database
+
+    Returns:
+        bool: False if a directory could not be watched
+
+    Raises:
+        None
+    """
+    # absolute paths of the directories which could not be watched
+    unwatched = []
+
+    def dispatch(event):
+        """Pass an inotify event to the event handler
+        """
+        if event.mask & pyinotify.IN_Q_OVERFLOW:
+            log.warning('inotify events lost, crawl to catch up')
+        elif event.mask & pyinotify.IN_MOVED_TO:
+            src_path = getattr(event, 'src_pathname', None)
+            if src_path:
+                events.moved(src_path, event.pathname, event.dir)
+            else:
+                events.created(event.pathname, event.dir)
+        elif event.mask & (pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE):
+            events.deleted(event.pathname, event.dir)
+        elif event.mask & pyinotify.IN_CLOSE_WRITE:
+            events.created(event.pathname)
+        elif event.mask & pyinotify.IN_CREATE and event.dir:
+            if manager.get_wd(event.pathname) is None:
+                # not added to the watches by auto_add
+                unwatched.append(event.pathname)
+            # files moved or copied into a directory before it is
+            # watched, those being copied are still growing
+            events.created_later(event.pathname)
+
+    mask = (
+        pyinotify.IN_CLOSE_WRITE |
+        pyinotify.IN_CREATE |
+        pyinotify.IN_DELETE |
+        pyinotify.IN_MOVED_FROM |
+        pyinotify.IN_MOVED_TO
+    )
+    manager = pyinotify.WatchManager()
+    notifier = pyinotify.Notifier(
+        manager, dispatch, timeout=_EVENT_TIMEOUT)
+    settled = time.time()
+    try:
+        for folder in settings.movie_folders.itervalues():
+            descriptors = manager.add_watch(
+                folder, mask, rec=True, auto_add=True)
+            unwatched.extend(
+                dirpath for dirpath, wd in descriptors.iteritems()
+                if wd < 0)
+            log.info('watching %s with inotify' % folder)
+        while watcher_status() and not unwatched:
+            notifier.process_events()
+            if notifier.check_events():
+                notifier.read_events()
+            if time.time() - settled >= _SETTLE_INTERVAL:
+                events.settle()
+                settled = time.time()
+    finally:
+        notifier.stop()
+    if unwatched:
+        # such as when the inotify watch limit is reached
+        log.error('%s directories could not be watched with inotify, '
+                  'such as %s' % (len(unwatched), unwatched[0]))
+        log.warning('watcher will poll, crawl to catch up')
+        return False
+    return True
+
+
+def _poll(settings, events, poll_interval):
+    """Watch movie folders by walking them until the watcher is stopped
+
+    The first walk lists every directory and records its movie files
+    without changing the database. Later walks only list directories
+    which changed since, see crawl.walk_folders.
+
+    Args:
+        settings(SettingsSnapshot): settings for this run
+        events(MovieEvents): applies events to the database
+        poll_interval(int): seconds between two walks
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    tops = list(settings.movie_folders.iteritems())
+    # folders nested in another one are walked for their own root
+    nested = frozenset(path.normpath(folder) for root, folder in tops)
+    # absolute directory path -> (mtime, inode)
+    snapshot = {}
+    # absolute directory path -> {filename: size} of video files
+    listed = {}
+    # absolute directory path -> set of filenames of movies
+    known = {}
+    throttles = Throttles(settings)
+    first = True
+    while watcher_status():
+        started = time.time()
+        seen = set()
+        for root, dirpath, files, state, subdirs in crawl.walk_folders(
+                tops, events.extensions, settings.crawl_workers,
+                snapshot=snapshot, running=watcher_status,
+                throttles=throttles, exclude=nested):
+            seen.add(dirpath)
+            if files is None:
+                # directory unchanged since last walk
+                continue
+            current = dict(
+                (filename, size) for filename, size, inode in files
+                if size is not None)
+            previous = listed.get(dirpath, {})
+            listed[dirpath] = current
+            movies = known.setdefault(dirpath, set())
+            for filename in list(movies):
+                if filename not in current:
+                    movies.discard(filename)
+                    events.deleted(path.join(dirpath, filename))
+            unsettled = False
+            for filename, size in current.iteritems():
+                if filename in movies:
+                    continue
+                if not first and previous.get(filename) != size:
+                    # still being written, listed again next walk
+                    unsettled = True
+                elif size >= crawl.MOVIE_SIZE_THRESHOLD:
+                    movies.add(filename)
+                    if not first:
+                        events.created(path.join(dirpath, filename))
+            if state is None:
+                continue
+            if unsettled or state[0] >= started - crawl.RACY_MTIME:
+                state = (0.0, ) + state[1:]
+            snapshot[dirpath] = state
+        if not watcher_status():
+            break
+        for dirpath in set(snapshot) - seen:
+            # directory removed since last walk
+            del snapshot[dirpath]
+            listed.pop(dirpath, None)
+            for filename in known.pop(dirpath, ()):
+                events.deleted(path.join(dirpath, filename))
+        first = False
+        log.debug('watcher walked %s directories in %.1f seconds' % (
+            len(seen), time.time() - started))
+        while watcher_status() and time.time() - started < poll_interval:
+            time.sleep(1)